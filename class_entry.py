@@ -8,17 +8,51 @@ __version__ = '0.1.9'   # Try not to forget to update it!
 
 import os
 import utils
+import threading
+from collections import OrderedDict, ChainMap
+from types import MappingProxyType, CoroutineType
 
 
 core_repository_path = os.path.dirname( os.path.realpath(__file__) )    # depends on relative position of THIS FILE in the repository
 
 
 class MicroKernel:
-    def __init__(self, parameters_location=('parameters.json',[]), code_container_name='python_code', entry_cache=None):
+    def __init__(self, parameters_location=('parameters.json',[]), code_container_name='python_code', entry_cache=None, path_cache_size=1024, scan_workers=None, parallel_branches=False, snapshot_path=None, async_concurrency=64,
+                 result_cache_dir=os.path.expanduser('~/.cache/ce/results'), result_cache_max_bytes=256*1024*1024):
         self.parameters_location    = parameters_location
         self.code_container_name    = code_container_name
         self.entry_cache            = entry_cache
 
+        ## Identity map of Entry objects loaded via bypath(), keyed by real path, in LRU order:
+        #
+        self.path_cache             = OrderedDict()
+        self.path_cache_size        = path_cache_size
+        self.path_cache_hits        = 0
+        self.path_cache_misses      = 0
+        self.path_cache_lock        = threading.Lock()
+
+        self.scan_workers           = scan_workers      # kernel-wide default for parallel collection scans (None means sequential)
+        self.parallel_branches      = parallel_branches # kernel-wide default for concurrent execution of independent pipeline branches
+        self.async_concurrency      = async_concurrency # kernel-wide default for the number of asynchronous calls in flight
+
+        self.method_cache_hits      = 0     # Entry.cached_method() statistics
+        self.method_cache_misses    = 0
+
+        self.parameters_stores      = {}    # real path of a collection -> the store that keeps its entries' parameters (see core_collection)
+
+        self.snapshot_path          = snapshot_path     # optional warm-start snapshot, see save_snapshot()
+        self.snapshot               = None              # lazy-loaded
+
+        ## On-disk store of the results of methods declared as 'cacheable_methods' by their entries.
+        #  It lives outside of the repository (in the user's cache by default) and is shared by all the processes using it:
+        #
+        self.result_cache_dir       = result_cache_dir
+        self.result_cache_max_bytes = result_cache_max_bytes   # the limit of the whole directory, not just of this process' writes
+        self.result_cache_bytes     = None              # lazy-computed running total, re-measured from the directory from time to time
+        self.result_cache_unscanned = 0                 # the bytes this process has added since the directory was last measured
+        self.result_cache_hits      = 0
+        self.result_cache_misses    = 0
+
 
     def version(self):
         """
@@ -40,13 +74,293 @@ class MicroKernel:
             return core_repository_path
 
 
+    def cache_stats(self):
+        """
+            Usage example:
+                clip cache_stats
+        """
+        return {
+            'path_cache_entries':   len(self.path_cache),
+            'path_cache_size':      self.path_cache_size,
+            'path_cache_hits':      self.path_cache_hits,
+            'path_cache_misses':    self.path_cache_misses,
+            'method_cache_hits':    self.method_cache_hits,
+            'method_cache_misses':  self.method_cache_misses,
+            'result_cache_hits':    self.result_cache_hits,
+            'result_cache_misses':  self.result_cache_misses,
+        }
+
+
+    def entry_stamp(self, entry_path):
+        """ A cheap fingerprint (mtime and size) of the entry's parameters and code files.
+            Used to notice on-disk changes without opening the files.
+        """
+        parameters_rel_path, _ = self.parameters_location
+
+        return tuple( utils.file_stamp( os.path.join(entry_path, file_name) ) for file_name in (parameters_rel_path, self.code_container_name+'.py') )
+
+
+    def restamp(self, entry_object):
+        """ Accept the current state of the entry's files after the entry has changed them itself.
+        """
+        real_path   = os.path.realpath(entry_object.get_path())
+        stamp       = self.entry_stamp(real_path)
+        with self.path_cache_lock:
+            cached_pair = self.path_cache.get(real_path)
+            if cached_pair and cached_pair[0] is entry_object:
+                self.path_cache[real_path] = (entry_object, stamp)
+        entry_object.real_path, entry_object.loaded_stamp = real_path, stamp
+
+
+    def result_cache_key(self, entry_object, function_name, function_object, pos_params, merged_params):
+        """ A content address of the call: the entry's identity, the hash of the code that defines the method
+            and a canonical hash of all the parameters. None if the call cannot be addressed this way.
+        """
+        import json
+        import hashlib
+
+        code_object = getattr(function_object, '__code__', None)
+        if not (entry_object.entry_path and code_object):
+            return None
+
+        try:
+            canonical_params = json.dumps( [pos_params, { k: v for k, v in merged_params.items() if k not in ('__kernel__', '__entry__') }],
+                                           sort_keys=True, separators=(',', ':') )
+        except (TypeError, ValueError):     # not all the parameters have a canonical form
+            return None
+
+        call_address = '\0'.join( [os.path.realpath(entry_object.entry_path), utils.file_hash(code_object.co_filename), function_name, canonical_params] )
+
+        return hashlib.sha256( call_address.encode('utf-8') ).hexdigest()
+
+
+    def parameters_store_for(self, entry_object):
+        """ Find the store that keeps the parameters of an entry without a parameters file of its own, if it belongs to a collection that has one.
+            The collections register their stores in parameters_stores, while the ones not opened yet are recognized by their database file.
+        """
+        dir_path = os.path.dirname( os.path.realpath(entry_object.get_path()) )
+        while True:
+            store = self.parameters_stores.get(dir_path)
+            if store==None and os.path.isfile( os.path.join(dir_path, '.entries.sqlite') ):
+                store = self.bypath(dir_path).call('entries_parameters_store')
+            if store:
+                return store if store.stored_version(entry_object)!=None else None
+
+            parent_dir_path = os.path.dirname(dir_path)
+            if parent_dir_path==dir_path:
+                return None
+            dir_path = parent_dir_path
+
+
+    def lookup_result(self, call_key):
+        """ Find the stored result of the call made before (by this or any other process): a (found, result) pair.
+            The results are kept under result_cache_dir (~/.cache/ce/results by default, outside of the repository).
+        """
+        import pickle
+
+        result_path = os.path.join(self.result_cache_dir, call_key[:2], call_key+'.pickle')
+        try:
+            with open(result_path, 'rb') as result_file:
+                result = pickle.load(result_file)
+            os.utime(result_path)       # recently used ones are evicted last
+            self.result_cache_hits += 1
+            return True, result
+        except OSError:             # not stored (yet)
+            self.result_cache_misses += 1
+        except Exception:           # damaged, or refers to the code that is no longer there (ModuleNotFoundError, AttributeError, ...)
+            self.result_cache_misses += 1
+            try:
+                os.remove(result_path)
+            except OSError:
+                pass
+
+        return False, None
+
+
+    def store_result(self, call_key, result):
+        """ Store the result of the call (unless it cannot be pickled or the directory is not writable),
+            evicting the least recently used results when the directory grows over result_cache_max_bytes.
+        """
+        import pickle
+
+        try:
+            result_bytes = pickle.dumps(result)
+        except (pickle.PicklingError, TypeError, AttributeError):  # not everything can be stored
+            return
+
+        result_path = os.path.join(self.result_cache_dir, call_key[:2], call_key+'.pickle')
+        temp_path   = '{}.{}.tmp'.format(result_path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(result_path), exist_ok=True)
+            with open(temp_path, 'wb') as result_file:
+                result_file.write(result_bytes)
+            os.replace(temp_path, result_path)
+        except OSError as e:        # the cache is only an optimization, the call still returns its result
+            print("KERNEL.store_result() could not store {}: {}".format(result_path, e))
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        self.evict_results( len(result_bytes) )
+
+
+    def memoized_call(self, entry_object, function_name, function_object, pos_params, merged_params):
+        """ Return the stored result of the same call made before (see lookup_result), or make the call and store its result.
+            For a coroutine method a coroutine is returned, which does the same once awaited.
+        """
+        from inspect import iscoroutinefunction
+
+        call_key = self.result_cache_key(entry_object, function_name, function_object, pos_params, merged_params)
+        if call_key==None:
+            return utils.free_access(function_object, pos_params, merged_params)
+
+        found, result = self.lookup_result(call_key)
+        if iscoroutinefunction(function_object):
+            async def memoized_coroutine():
+                if found:
+                    return result
+                awaited_result = await utils.free_access(function_object, pos_params, merged_params)
+                self.store_result(call_key, awaited_result)
+                return awaited_result
+
+            return memoized_coroutine()
+        elif not found:
+            result = utils.free_access(function_object, pos_params, merged_params)
+            self.store_result(call_key, result)
+
+        return result
+
+
+    def evict_results(self, added_bytes=0):
+        """ Keep the result store within result_cache_max_bytes by removing the least recently used results.
+            Since other processes may be adding to the same directory, its actual size is measured on the first call,
+            whenever this process has added another tenth of the limit since, and before anything gets evicted.
+        """
+        self.result_cache_unscanned += added_bytes
+
+        if (self.result_cache_bytes==None or self.result_cache_unscanned >= self.result_cache_max_bytes * 0.1
+                or self.result_cache_bytes + added_bytes > self.result_cache_max_bytes):
+            stored_results              = utils.list_files_by_mtime(self.result_cache_dir)
+            self.result_cache_bytes     = sum(size for _, _, size in stored_results)
+            self.result_cache_unscanned = 0
+        else:
+            self.result_cache_bytes += added_bytes
+
+        if self.result_cache_bytes > self.result_cache_max_bytes:
+            for _, result_path, size in stored_results:
+                if self.result_cache_bytes <= self.result_cache_max_bytes * 0.9:
+                    break
+                elif result_path.endswith('.tmp'):  # still being written by someone
+                    continue
+                try:
+                    os.remove(result_path)
+                    self.result_cache_bytes -= size
+                except OSError:
+                    pass
+
+
+    def snapshot_loaded(self):
+        """ Load the warm-start snapshot (if there is one) in a single read and prime the call adapters from it.
+            Its records are only trusted for the files that have not changed since.
+        """
+        if self.snapshot==None:     # lazy-loading condition
+            self.snapshot = { 'entries': {}, 'call_adapters': {} }
+            if self.snapshot_path and os.path.isfile(self.snapshot_path):
+                import marshal
+                try:
+                    with open(self.snapshot_path, 'rb') as snapshot_file:
+                        self.snapshot = marshal.load(snapshot_file)
+                except (EOFError, ValueError, TypeError) as e:
+                    print("KERNEL.snapshot_loaded() ignoring a broken snapshot {}: {}".format(self.snapshot_path, e))
+                utils.import_call_adapters( self.snapshot['call_adapters'] )
+
+        return self.snapshot
+
+
+    def save_snapshot(self):
+        """ Store the parameters of the entries loaded so far (unless changed in memory)
+            and the call adapters of all the methods called so far, to make the next cold start warm.
+
+            Usage example (clip saves a snapshot after every run if the variable is set) :
+                CLIP_SNAPSHOT=/tmp/clip.snapshot clip byname --entry_name=words_collection , get_path
+        """
+        import marshal
+        from copy import deepcopy
+
+        entry_records = dict( self.snapshot_loaded()['entries'] )
+        for real_path, (entry_object, stamp) in list(self.path_cache.items()):
+            if entry_object.own_parameters!=None and entry_object.parameters_version==0:
+                entry_record = { 'stamp': stamp, 'own_parameters': deepcopy(entry_object.own_parameters) }  # never shared with the live entry
+                try:
+                    marshal.dumps(entry_record)
+                    entry_records[real_path] = entry_record
+                except ValueError:      # not everything can be stored
+                    pass
+
+        snapshot = {
+            'entries':          entry_records,
+            'call_adapters':    utils.export_call_adapters(),
+        }
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'wb') as snapshot_file:
+            marshal.dump(snapshot, snapshot_file)
+        os.replace(temp_path, self.snapshot_path)
+
+        return self.snapshot_path
+
+
     def bypath(self, path, *args, **kwargs):
         """
             Usage example:
                 clip bypath --path=foo_entry , foo --alpha=12 --beta=23 --gamma=34
         """
-        print("KERNEL.bypath({}, {}, {})".format(path, args, kwargs))
-        return Entry(*args, **kwargs, entry_path=path, kernel=self)
+        if args or kwargs:      # an Entry with explicitly given internals is never shared
+            print("KERNEL.bypath({}, {}, {})".format(path, args, kwargs))
+            return Entry(*args, **kwargs, entry_path=path, kernel=self)
+
+        real_path   = os.path.realpath(path)
+        stamp       = self.entry_stamp(real_path)
+
+        with self.path_cache_lock:      # bypath() may be called from several scanning threads at once
+            cached_pair = self.path_cache.get(real_path)
+
+            if cached_pair and cached_pair[1]==stamp and not cached_pair[0].ancestors_changed():
+                self.path_cache_hits += 1
+                self.path_cache.move_to_end(real_path)
+                return cached_pair[0]
+
+            print("KERNEL.bypath({}, {}, {})".format(path, args, kwargs))
+            self.path_cache_misses += 1
+
+            own_parameters = None
+            if self.snapshot_path:
+                entry_record = self.snapshot_loaded()['entries'].pop(real_path, None)  # the entry takes over the record's parameters
+                if entry_record and entry_record['stamp']==stamp:
+                    own_parameters = entry_record['own_parameters']
+
+            entry_object = Entry(entry_path=real_path, own_parameters=own_parameters, kernel=self)   # shared, so it must not depend on the caller's cwd
+            entry_object.real_path, entry_object.loaded_stamp = real_path, stamp
+
+            self.path_cache[real_path] = (entry_object, stamp)
+            self.path_cache.move_to_end(real_path)
+            while len(self.path_cache) > self.path_cache_size:
+                self.path_cache.popitem(last=False)     # evict the least recently used one
+
+        return entry_object
+
+
+    def map(self, function_name, entry_object, params_list, pos_params=None, common_params=None, chunk_size=None, max_workers=None, parallel=None):
+        """ Call the same method of one entry (given as an object or a path) over many parameter sets, see Entry.call_many()
+
+            Usage example:
+                clip map fibonacci --entry_object=working_collection/recursive_functions --params_list.n,=10,20,30 --parallel=thread
+        """
+        if type(entry_object)==str:
+            entry_object = self.bypath( entry_object if os.path.isabs(entry_object) else self.get_kernel_path(entry_object) )
+
+        return entry_object.call_many(function_name, params_list, pos_params, common_params, chunk_size, max_workers, parallel)
 
 
     def cached(self, entry_name):
@@ -57,7 +371,11 @@ class MicroKernel:
             self.entry_cache['core_collection']     = self.bypath( self.get_kernel_path('core_collection') )
             self.entry_cache['working_collection']  = self.bypath( self.get_kernel_path('working_collection') )
 
-        return self.entry_cache.get(entry_name)
+        cached_object = self.entry_cache.get(entry_name)
+        if cached_object and (cached_object.changed_on_disk() or cached_object.ancestors_changed()):   # e.g. another process has added an entry to it
+            cached_object = self.entry_cache[entry_name] = self.bypath( cached_object.get_path() )
+
+        return cached_object
 
 
     def working_collection(self):
@@ -85,6 +403,10 @@ class MicroKernel:
 default_kernel_instance = MicroKernel()
 
 
+def bypath_of_default_kernel(path):
+    return default_kernel_instance.bypath(path)
+
+
 class Entry:
     def __init__(self, entry_path=None, parent_entry=None, own_parameters=None, kernel=default_kernel_instance):
         print("__init__ Entry({}) -> {}".format(entry_path, self))
@@ -93,10 +415,32 @@ class Entry:
         self.own_parameters = own_parameters
         self.kernel         = kernel
 
+        self.parameters_version         = 0     # bumped on every change made via update() or __setitem__()
+        self.merged_parameters_cache    = None  # (ancestry_versions, merged_parameters)
+
+        self.collection_entry = None    # the collection this entry was reached through, if known
+        self.parameters_store = None    # where own_parameters are kept, if not in the entry's own parameters file (see core_collection)
+        self.stored_version   = None    # the version of own_parameters in the parameters_store, as loaded
+
+        self.real_path      = None      # both set by the kernel when it loads the entry from disk
+        self.loaded_stamp   = None
+
         ## Placeholder(s) for lazy loading:
         #
 
         self.module_object  = None
+        self.method_cache   = {}    # function_name -> (function_object or None, ancestry_path)
+
+
+    def __reduce__(self):
+        "Entries travel between processes by path, and get re-loaded on the other side"
+
+        if self.entry_path and self.parameters_store:  # the other side may not know where the parameters are kept
+            return (Entry, (self.entry_path, None, self.parameters_loaded()))
+        elif self.entry_path:
+            return (bypath_of_default_kernel, (self.entry_path,))
+        else:
+            return (Entry, (None, None, self.own_parameters))
 
 
     def get_path(self, file_name=None):
@@ -134,8 +478,15 @@ class Entry:
 
     def parameters_loaded(self):
         if self.own_parameters==None:       # lazy-loading condition
-            parameters_rel_path, parameters_struct_path = self.kernel.parameters_location
-            self.own_parameters, _ = utils.quietly_load_json_config( self.get_path(parameters_rel_path), parameters_struct_path )
+            if self.parameters_store:
+                self.own_parameters = self.parameters_store.load_parameters(self)
+            else:
+                parameters_rel_path, parameters_struct_path = self.kernel.parameters_location
+                self.own_parameters, found = utils.quietly_load_json_config( self.get_path(parameters_rel_path), parameters_struct_path )
+                if not found:   # it may still be a member of a collection that keeps the parameters of its entries elsewhere
+                    self.parameters_store = self.kernel.parameters_store_for(self)
+                    if self.parameters_store:
+                        self.own_parameters = self.parameters_store.load_parameters(self)
 
         return self.own_parameters
 
@@ -148,9 +499,17 @@ class Entry:
         own_parameters = self.parameters_loaded()
         if data:
             own_parameters.update( data)
+        self.parameters_version += 1
+
+        if self.parameters_store:
+            self.parameters_store.store_parameters(self, own_parameters)
+        else:
+            parameters_rel_path, parameters_struct_path = self.kernel.parameters_location
+            utils.store_structure_to_json_file(own_parameters, self.get_path(parameters_rel_path))
+            self.kernel.restamp(self)
 
-        parameters_rel_path, parameters_struct_path = self.kernel.parameters_location
-        utils.store_structure_to_json_file(own_parameters, self.get_path(parameters_rel_path))
+        if self.collection_entry:       # keep the collection's tag index current
+            self.collection_entry.call('reindex_entry', { 'entry_object': self })
 
         return own_parameters
 
@@ -182,33 +541,56 @@ class Entry:
 
     def __setitem__(self, param_name, param_value):
         self.parameters_loaded()[param_name] = param_value
+        self.parameters_version += 1
 
 
     def get_module_object(self):
         if self.module_object==None:    # lazy-loading condition
+            self.method_cache  = {}     # whatever was resolved before is not to be trusted after a (re)load
             self.module_object = utils.get_entrys_python_module(self.entry_path, code_container_name=self.kernel.code_container_name) or False
 
         return self.module_object
 
 
-    def reach_method(self, function_name, _ancestry_path=None):
-        """ Find a method for the given entry - either its own or belonging to one of its parents.
+    def cached_method(self, function_name):
+        """ Resolve a method along the ancestry path and remember the outcome, including a miss.
+            Returns the function_object (None if not found) and the ancestry path that was walked.
         """
+        cached_pair = self.method_cache.get(function_name)
+        if cached_pair:
+            self.kernel.method_cache_hits += 1
+            return cached_pair
 
-        if _ancestry_path == None:
-            _ancestry_path = []
-
-        _ancestry_path += [ self.get_name() ]
+        self.kernel.method_cache_misses += 1
+        ancestry_path = [ self.get_name() ]
         try:
             module_object   = self.get_module_object()
             function_object = getattr(module_object, function_name)
         except (ImportError, AttributeError) as e:
             if self.parent_loaded():
-                return self.parent_entry.reach_method(function_name, _ancestry_path)
+                function_object, parent_ancestry_path = self.parent_entry.cached_method(function_name)
+                ancestry_path += parent_ancestry_path
             else:
-                raise NameError( "could not find the method '{}' along the ancestry path '{}'".format(function_name, ' --> '.join(_ancestry_path) ) )
+                function_object = None
 
-        return function_object
+        cached_pair = (function_object, ancestry_path)
+        self.method_cache[function_name] = cached_pair
+        return cached_pair
+
+
+    def reach_method(self, function_name, _ancestry_path=None):
+        """ Find a method for the given entry - either its own or belonging to one of its parents.
+        """
+
+        function_object, ancestry_path = self.cached_method(function_name)
+
+        if _ancestry_path != None:
+            _ancestry_path += ancestry_path
+
+        if function_object:
+            return function_object
+        else:
+            raise NameError( "could not find the method '{}' along the ancestry path '{}'".format(function_name, ' --> '.join(ancestry_path) ) )
 
 
     def help(self, method_name=None):
@@ -252,13 +634,82 @@ class Entry:
                 print( str(e) )
 
 
+    def changed_on_disk(self):
+        "Whether the entry's files have changed since the kernel loaded it (never true for the entries made in memory)"
+
+        return self.loaded_stamp!=None and self.kernel.entry_stamp(self.real_path)!=self.loaded_stamp
+
+
+    def ancestors_changed(self):
+        "Whether any of the already loaded ancestors has changed on disk since it was loaded"
+
+        entry = self.parent_entry
+        while entry:
+            if entry.changed_on_disk():
+                return True
+            entry = entry.parent_entry
+
+        return False
+
+
+    def ancestry_versions(self):
+        """ The identities and parameter versions of this entry and all its ancestors - cheap to compute and compare.
+            An ancestor that has changed on disk gets re-resolved (so it is a different object with a different identity).
+        """
+        versions    = []
+        entry       = self
+        while entry:
+            versions.append( (id(entry), entry.parameters_version) )
+            parent_entry = entry.parent_loaded()
+            if parent_entry and parent_entry.changed_on_disk():
+                entry.parent_entry  = None
+                parent_entry        = entry.parent_loaded()
+            entry = parent_entry
+
+        return tuple(versions)
+
+
     def generate_merged_parameters(self):
-        own_parameters = self.parameters_loaded()
+        """ The effective parameters of the entry, layered over the whole ancestry (the closest ancestor wins).
+            Computed once and reused until this entry or any of its ancestors changes via update() or __setitem__().
+            The result is shared, so treat it as read-only.
+        """
+        ancestry_versions = self.ancestry_versions()
+
+        if self.merged_parameters_cache==None or self.merged_parameters_cache[0]!=ancestry_versions:
+            own_parameters = self.parameters_loaded()
+
+            if self.parent_loaded():
+                merged_parameters = utils.merged_dictionaries(self.parent_entry.generate_merged_parameters(), own_parameters)
+            else:
+                merged_parameters = dict(own_parameters)
+
+            self.merged_parameters_cache = (ancestry_versions, merged_parameters)
+
+        return self.merged_parameters_cache[1]
 
-        if self.parent_loaded():
-            return utils.merged_dictionaries(self.parent_entry.parameters_loaded(), own_parameters)
+
+    def _call_resolved(self, function_name, function_object, pos_params, param_layers, cacheable=None):
+        """ Call the already resolved method with a read-only view of its parameters: the special parameters
+            on top of the given layers (the closest first), nothing gets copied. The result is memoized
+            if the method is one of the 'cacheable_methods' (unless the caller has already decided that with cacheable).
+            call(), acall() and call_many() all go through here, so that the three always see the same parameters.
+        """
+        merged_params = MappingProxyType( ChainMap(
+            {                               # These special parameters are non-overridable at the moment. Should they be?
+                '__kernel__'    : self.kernel,
+                '__entry__'     : self,
+            },
+            *param_layers,
+        ) )
+
+        if cacheable==None:
+            cacheable = function_name in (merged_params.get('cacheable_methods') or [])
+
+        if cacheable:
+            return self.kernel.memoized_call(self, function_name, function_object, pos_params, merged_params)
         else:
-            return own_parameters
+            return utils.free_access(function_object, pos_params, merged_params)
 
 
     def call(self, function_name, call_specific_params=None, pos_params=None, entry_wide_params=None):
@@ -272,14 +723,8 @@ class Entry:
             function_object     = self.reach_method(function_name)
 
             entry_wide_params   = entry_wide_params or self.generate_merged_parameters()
-            merged_params       = utils.merged_dictionaries(entry_wide_params, call_specific_params) if call_specific_params else entry_wide_params
 
-            merged_params.update( {             # These special parameters are non-overridable at the moment. Should they be?
-                '__kernel__'    : self.kernel,
-                '__entry__'     : self,
-            } )
-
-            result = utils.free_access(function_object, pos_params, merged_params)
+            result = self._call_resolved(function_name, function_object, pos_params, [ call_specific_params or {}, entry_wide_params ])
         except NameError as method_not_found_e:
             try:
                 entry_method_object = getattr(self, function_name)
@@ -291,9 +736,85 @@ class Entry:
                 except AttributeError:
                     raise method_not_found_e
 
+        if isinstance(result, CoroutineType):   # a coroutine method called synchronously
+            import asyncio
+            try:
+                asyncio.get_running_loop()      # from within a coroutine the awaitable is returned for the caller to await
+            except RuntimeError:                # otherwise it runs to completion in its own event loop
+                result = asyncio.run(result)
+
         return result
 
 
+    async def acall(self, function_name, call_specific_params=None, pos_params=None, entry_wide_params=None, executor=None):
+        """ The asynchronous counterpart of call(): coroutine methods are awaited natively,
+            while the synchronous ones are offloaded to the executor (the event loop's default one if None),
+            so that the event loop is never blocked. The results of 'cacheable_methods' are memoized either way.
+        """
+        import asyncio
+        from functools import partial
+
+        try:
+            function_object = self.reach_method(function_name)
+        except NameError:
+            function_object = None
+
+        if asyncio.iscoroutinefunction(function_object):
+            pos_params          = pos_params or []
+            entry_wide_params   = entry_wide_params or self.generate_merged_parameters()
+
+            return await self._call_resolved(function_name, function_object, pos_params, [ call_specific_params or {}, entry_wide_params ])
+        else:
+            return await asyncio.get_running_loop().run_in_executor( executor, partial(self.call, function_name, call_specific_params, pos_params, entry_wide_params) )
+
+
+    def call_many(self, function_name, params_list, pos_params=None, common_params=None, chunk_size=None, max_workers=None, parallel=None):
+        """ Call the same function of the entry once per each call-specific parameter set and return the results in order.
+
+            The method and the entry-wide parameters are resolved once for the whole batch, not per call
+            (so is the decision whether the method is cacheable, taken from common_params or the entry).
+            The params_list is either a list (or any iterable) of dictionaries, or a dictionary of equal-length lists
+            that gets zipped into one (e.g. {'n': [10,20]} means [{'n':10},{'n':20}]).
+            With parallel='thread' or 'process' the batch is cut into chunks of chunk_size that run in a pool of max_workers.
+
+            Usage example:
+                clip byname --entry_name=recursive_functions , call_many fibonacci --params_list.n,=10,20,30 --common_params.alpha=1
+        """
+
+        if type(params_list)==dict:
+            param_names = list(params_list.keys())
+            params_list = [ dict(zip(param_names, param_values)) for param_values in zip(*params_list.values()) ]
+        else:
+            params_list = list(params_list or [])
+
+        pos_params      = pos_params or []
+        common_params   = common_params or {}
+
+        if parallel:
+            from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+            from operator import methodcaller
+
+            chunk_size  = chunk_size or max(1, -(-len(params_list) // (4 * (max_workers or os.cpu_count() or 1))))
+            chunks      = [ params_list[i:i+chunk_size] for i in range(0, len(params_list), chunk_size) ]
+
+            # methodcaller pickles well, and the Entry travels to worker processes by path:
+            pool_class  = ProcessPoolExecutor if parallel=='process' else ThreadPoolExecutor
+            with pool_class(max_workers=max_workers) as pool:
+                chunk_futures = [ pool.submit(methodcaller('call_many', function_name, chunk, pos_params, common_params), self) for chunk in chunks ]
+                return [ result for chunk_future in chunk_futures for result in chunk_future.result() ]
+
+        try:
+            function_object     = self.reach_method(function_name)
+        except NameError:       # Entry's or kernel's own methods do not need any resolution
+            return [ self.call(function_name, dict(common_params, **call_specific_params), pos_params) for call_specific_params in params_list ]
+
+        entry_wide_params   = self.generate_merged_parameters()
+        cacheable           = function_name in (ChainMap(common_params, entry_wide_params).get('cacheable_methods') or [])
+
+        return [ self._call_resolved(function_name, function_object, pos_params, [ call_specific_params, common_params, entry_wide_params ], cacheable)
+                 for call_specific_params in params_list ]
+
+
 if __name__ == '__main__':
 
     print("Kernel version = {}".format(default_kernel_instance.version()))
@@ -386,3 +907,36 @@ if __name__ == '__main__':
     download_entry = default_kernel_instance.byname('download_entry')
     download_entry.help()
     download_entry.help(method_name='download')
+
+
+    ## Cold-start regression check: the same command lines in fresh processes, without and with a warm-start snapshot
+    #
+    import sys
+    import subprocess
+    import tempfile
+    import time
+
+    clip_path   = os.path.join(core_repository_path, 'clip')
+    cold_env    = { k: v for k, v in os.environ.items() if k not in ('CLIP_SNAPSHOT', 'CLIP_SOCKET') }
+
+    def best_run(command_line, env, runs=5):
+        "The best wall time (in ms) of running the command line, and its final result line"
+
+        best_time = None
+        for _ in range(runs):
+            start_time  = time.time()
+            output      = subprocess.run([sys.executable, clip_path] + command_line, env=env, stdout=subprocess.PIPE, universal_newlines=True).stdout
+            elapsed     = (time.time() - start_time) * 1000
+            best_time   = elapsed if best_time==None else min(best_time, elapsed)
+        return best_time, output.splitlines()[-1]
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        for command_line in ( ['version'], ['byname', '--entry_name=words_collection', ',', 'get_path'] ):
+            warm_env = dict(cold_env, CLIP_SNAPSHOT=os.path.join(snapshot_dir, command_line[0]+'.snapshot'))
+            subprocess.run([sys.executable, clip_path] + command_line, env=warm_env, stdout=subprocess.DEVNULL)    # leaves the snapshot
+
+            cold_time, cold_result = best_run(command_line, cold_env)
+            warm_time, warm_result = best_run(command_line, warm_env)
+            print("COLD START: clip {} : {:.1f} ms without, {:.1f} ms with a snapshot{}{}".format(' '.join(command_line), cold_time, warm_time,
+                    '' if warm_result==cold_result else ', RESULTS DIFFER: {} vs {}'.format(cold_result, warm_result),
+                    ', REGRESSION' if warm_time > cold_time*1.2 else ''))
@@ -60,6 +60,10 @@ def parse(arglist):
             ,               # pass the object that is the expected result of the previous step to the next step
             ,:cache_label   # do not pass the previous result, rather start from a cached object
             ,,              # do not pass the previous result, rather start from working_collection
+            ,{              # iterate: apply the next method to each element of the previous result
+            ,{8 or ,{t8     # iterate in parallel, using a pool of 8 threads
+            ,{p4            # iterate in parallel, using a pool of 4 processes (the number is optional)
+            ,{a100          # iterate asynchronously, with up to 100 calls in flight (the number is optional)
     """
 
     def to_num_or_not_to_num(x):
@@ -99,17 +103,21 @@ def parse(arglist):
             if arglist[i]==',,':
                 curr_link['begin_with'] = ',,'
             else:
-                matched_separator = re.match('^,(:[\w\.]+)?(\{?)$', arglist[i])
+                matched_separator = re.match(r'^,(:[\w\.]+)?(\{([tpa]?)(\d*))?$', arglist[i])
                 if matched_separator:
                     if matched_separator.group(1):
                         curr_link['begin_with'] = matched_separator.group(1)
                     if matched_separator.group(2):
-                        curr_link['iterate']    = matched_separator.group(2) == '{'
+                        curr_link['iterate']    = True
+                        if matched_separator.group(3) or matched_separator.group(4):
+                            curr_link['parallel']       = { 'p': 'process', 'a': 'async' }.get(matched_separator.group(3), 'thread')
+                        if matched_separator.group(4):
+                            curr_link['max_workers']    = int(matched_separator.group(4))
             i += 1
 
         ## There may be a label, check for it:
         #
-        matched_label = re.match('^(\w+):$', arglist[i])
+        matched_label = re.match(r'^(\w+):$', arglist[i])
         if matched_label:
             curr_link['label'] = matched_label.group(1)
             i += 1
@@ -130,12 +138,12 @@ def parse(arglist):
                 call_pos_params.append( to_num_or_not_to_num(arglist[i]) )
             else:
                 call_param_key = None
-                matched_paramref = re.match('^--([\w\.]*:)([\w\.]+)$', arglist[i])
+                matched_paramref = re.match(r'^--([\w\.]*:)([\w\.]+)$', arglist[i])
                 if matched_paramref:
                     call_param_key      = matched_paramref.group(1)
                     call_param_value    = matched_paramref.group(2)
                 else:
-                    matched_parampair = re.match('^--([\w\.]+)([\ ,;:]?)=(.*)$', arglist[i])
+                    matched_parampair = re.match(r'^--([\w\.]+)([\ ,;:]?)=(.*)$', arglist[i])
                     if matched_parampair:
                         call_param_key      = matched_parampair.group(1)
                         delimiter           = matched_parampair.group(2)
@@ -145,7 +153,7 @@ def parse(arglist):
                         else:
                             call_param_value    = to_num_or_not_to_num(call_param_value)
                     else:
-                        matched_paramsingle = re.match('^--([\w\.]+)([,-]?)$', arglist[i])
+                        matched_paramsingle = re.match(r'^--([\w\.]+)([,-]?)$', arglist[i])
                         if matched_paramsingle:
                             call_param_key      = matched_paramsingle.group(1)
                             if matched_paramsingle.group(2) == ',':
@@ -170,7 +178,7 @@ if __name__ == '__main__':
 
     ## When the entry's code is run as a script, perform local tests:
     #
-    cmd_line = 'clip labA: method_A posA1 --p5- -p6=60 --p7= -p6=600 --p8.key1=v81 --p8.key2=82 , labB: method_B ,, method_C --p9.alpha.beta=999 -p9.alpha.gamma=boo -p10 --data.empty1 --data.empty2= --data.empty3,= --data.empty4, ,, methodD paramD1 --paramD2 ,{ methodE paramE1 , methodF --paramF1=valF1'
+    cmd_line = 'clip labA: method_A posA1 --p5- -p6=60 --p7= -p6=600 --p8.key1=v81 --p8.key2=82 , labB: method_B ,, method_C --p9.alpha.beta=999 -p9.alpha.gamma=boo -p10 --data.empty1 --data.empty2= --data.empty3,= --data.empty4, ,, methodD paramD1 --paramD2 ,{ methodE paramE1 , methodF --paramF1=valF1 ,{p4 methodG'
     parsed_cmd = parse( cmd_line.split(' ') )
 
     from pprint import pprint
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+""" A long-running kernel that serves clip command lines over a local Unix socket.
+
+    The kernel, its caches and all the loaded collections and modules stay warm between the commands,
+    so a command costs milliseconds instead of a fresh interpreter start.
+
+    Start the daemon:
+        clip byname --entry_name=clip_daemon , serve --socket_path=/tmp/clip.sock
+
+    Make clip forward its command lines to it (clip falls back to running locally if nobody listens):
+        export CLIP_SOCKET=/tmp/clip.sock
+
+    The protocol: the client sends one JSON line {"argv": [...], "cwd": "...", "parallel_branches": false},
+    the daemon streams back the output, then a NUL byte followed by the exit code.
+"""
+
+
+def execute_command_line(argv, __kernel__):
+    "The same bootstrap as in clip itself: parse the command line and execute the resulting pipeline"
+
+    parsed_command  = __kernel__.byname('cli_parser3').call('parse', { 'arglist': argv })
+    result          = __kernel__.byname('pipeliner3').call('execute', parsed_command)
+
+    print("clip final result: {}".format(result))
+
+
+def serve(socket_path, max_requests=None, __kernel__=None):
+    """ Serve the command lines one at a time (their output is captured by redirecting the process-wide stdout).
+        Each command runs in the client's cwd, while the warm entries are keyed by their real paths,
+        and the cached collections are revalidated by their files' stamps (so the changes made by other processes show).
+
+        Usage example:
+            clip byname --entry_name=clip_daemon , serve --socket_path=/tmp/clip.sock
+    """
+    import os
+    import sys
+    import json
+    import socket
+    import traceback
+    from contextlib import redirect_stdout, redirect_stderr
+
+    socket_path = os.path.expanduser(socket_path)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_socket.bind(socket_path)
+    server_socket.listen()
+    print("CLIP_DAEMON.serve() listening on {}".format(socket_path))
+
+    requests_served = 0
+    try:
+        while max_requests==None or requests_served<max_requests:
+            connection, _ = server_socket.accept()
+            with connection, connection.makefile('r') as input_file, connection.makefile('w', buffering=1) as output_file:    # line-buffered output streams back
+                request     = json.loads( input_file.readline() )
+                exit_code   = 0
+
+                saved_argv, saved_cwd, saved_parallel_branches = sys.argv, os.getcwd(), __kernel__.parallel_branches
+                try:
+                    sys.argv = request['argv']
+                    os.chdir( request['cwd'] )
+                    __kernel__.parallel_branches = request.get('parallel_branches', saved_parallel_branches)
+                    with redirect_stdout(output_file), redirect_stderr(output_file):
+                        try:
+                            execute_command_line(request['argv'], __kernel__)
+                        except Exception:
+                            traceback.print_exc()
+                            exit_code = 1
+                    output_file.write( '\0{}'.format(exit_code) )
+                    output_file.flush()
+                except OSError as e:    # the client went away
+                    print("CLIP_DAEMON.serve() dropped a client: {}".format(e))
+                finally:
+                    sys.argv = saved_argv
+                    os.chdir( saved_cwd )
+                    __kernel__.parallel_branches = saved_parallel_branches
+
+            requests_served += 1
+    finally:
+        server_socket.close()
+        os.unlink(socket_path)
+
+    return requests_served
@@ -21,90 +21,382 @@ def traverse(dictionary, key_path, complete=True):
         return dict_ptr, last_syllable
 
 
-def execute(pipeline, __kernel__=None):
+def lazy_calls(entry_objects, method, merged_params, pos_params):
+    "Apply the method to the entries one by one, as soon as each of them arrives"
 
-    #import sys
-    #sys.path.append( __kernel__.get_kernel_path() )
-    #import utils
+    for entry_object in entry_objects:
+        yield entry_object.call(method, merged_params, pos_params)
 
-    wc                  = __kernel__.working_collection()
-    entry_type          = type(wc)
-    result_cache        = {}
-    curr_entry_object   = wc
-    iteration_mode      = False
+
+def parallel_calls(entry_objects, method, merged_params, pos_params, parallel='thread', max_workers=None):
+    """ Apply the method to all the entries using a pool of threads or processes.
+        The results come back in the original order, and a failure is recorded in place of its result
+        (elements that have already failed are passed through) instead of aborting the whole batch.
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    from operator import methodcaller
+
+    # methodcaller pickles well, and Entry objects travel to worker processes by path:
+    caller = methodcaller('call', method, merged_params, pos_params)
+
+    pool_class = ProcessPoolExecutor if parallel=='process' else ThreadPoolExecutor
+    with pool_class(max_workers=max_workers) as pool:
+        futures = [ entry_object if isinstance(entry_object, Exception) else pool.submit(caller, entry_object) for entry_object in entry_objects ]
+
+        result_list = []
+        for future in futures:
+            if isinstance(future, Exception):
+                result_list.append( future )
+            else:
+                try:
+                    result_list.append( future.result() )
+                except Exception as e:
+                    print("PIPELINER.parallel_calls() {}: {}".format(type(e).__name__, e))
+                    result_list.append( e )
+
+    return result_list
+
+
+async def gather_calls(entry_objects, method, merged_params, pos_params, max_concurrency=None, executor=None, semaphore=None):
+    """ Apply the method to all the entries asynchronously, keeping at most max_concurrency calls in flight
+        (or sharing the given semaphore with the other calls it bounds).
+        The results come back in the original order, with failures recorded in place (same as in parallel_calls).
+    """
+    import asyncio
+
+    semaphore = semaphore or asyncio.Semaphore(max_concurrency)
+
+    async def bounded_call(entry_object):
+        if isinstance(entry_object, Exception):
+            return entry_object
+
+        async with semaphore:
+            try:
+                return await entry_object.acall(method, merged_params, pos_params, executor=executor)
+            except Exception as e:
+                print("PIPELINER.gather_calls() {}: {}".format(type(e).__name__, e))
+                return e
+
+    return list( await asyncio.gather( *[ bounded_call(entry_object) for entry_object in entry_objects ] ) )
+
+
+def async_calls(entry_objects, method, merged_params, pos_params, max_concurrency=None, __kernel__=None):
+    """ Apply the method to all the entries in an event loop of its own, keeping at most max_concurrency
+        (or kernel's async_concurrency) calls in flight. Synchronous methods are offloaded to as many threads.
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    max_concurrency = max_concurrency or __kernel__.async_concurrency
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        return asyncio.run( gather_calls(entry_objects, method, merged_params, pos_params, max_concurrency, executor) )
+
+
+def prepare(pipeline):
+    """ Compile the pipeline into a reusable plan, so that repeated runs skip all the format normalization
+        and key path splitting, and only bind the values that change (see run_plan).
+
+        The pipeline is split into branches (runs of links that begin at a restart) and every reference
+        to a label (either in begin_with or in 'key:' parameters) is resolved to its latest producing link.
+        Labels that no link produces are expected to be bound at run time.
+
+        Usage example:
+            clip byname --entry_name=pipeliner3 , prepare --pipeline.method=factorial
+    """
 
     if pipeline==[]:
         pipeline = [{ 'method': 'help' }]
     elif type(pipeline)==dict:  # ensuring the pipeline format is a LoD
         pipeline = [pipeline]
 
+    link_plans          = []
+    branches            = []
+    label_2_link_idx    = {}    # the latest producer of each label, as seen by the sequential order
+    iteration_mode      = False
+    parallel            = None
+    max_workers         = None
+
     for curr_link_idx in range(len(pipeline)):
         curr_link   = pipeline[curr_link_idx]
         begin_with  = curr_link.get('begin_with')
-        iteration_mode = iteration_mode or curr_link.get('iterate', False)
-        label       = curr_link.get('label')
         method      = curr_link['method']       # the mandatory part
         pos_params  = curr_link.get('pos_params', [])
-        param_layers= curr_link.get('params', [])
-
-        ## Re-start if explicitly required:
-        #
-        if begin_with:
-            if (type(begin_with) == str) and begin_with.startswith(':'):                # fetch the cached value
-                curr_entry_object = traverse(result_cache, begin_with[1:].split('.'))
-            elif begin_with == ',,':                                                    # restart from wc
-                curr_entry_object   = wc
-                iteration_mode      = False
-            else:                                                                       # or use the given value
-                curr_entry_object = begin_with
-            #
-            # we'll deal with possible class/cardinality mismatches later ...
-        elif curr_link_idx==0 and method=='help' and pos_params==[] and (param_layers==[] or param_layers=={}):
-            curr_entry_object   = wc.call('byname', {'entry_name': 'cli_parser3'})
-        #
-        # otherwise just stay with curr_entry_object ...
+        iteration_mode = iteration_mode or curr_link.get('iterate', False)
+        if curr_link.get('iterate', False):
+            parallel    = curr_link.get('parallel')
+            max_workers = curr_link.get('max_workers')
+        if begin_with == ',,':
+            iteration_mode  = False
+            parallel        = None
+            max_workers     = None
 
         ## Bringing to the common format with multiple layers:
         #
+        param_layers = curr_link.get('params', [])
         if type(param_layers)==dict:
             param_layers = [ param_layers ]
 
-        ## Going through editing layers and applying the edits:
+        ## Pre-splitting the key paths of the edits:
         #
-        merged_params = {}
+        referenced_labels   = []
+        param_template      = []
         for param_layer in param_layers:
             for k_str in param_layer.keys():
                 if k_str[-1] == ':':                    # reference to a previously cached result or its subcomponent
-                    m_keypath   = k_str[:-1].split('.')
-                    m_value     = traverse(result_cache, param_layer[k_str].split('.'))
+                    ref_keypath = param_layer[k_str].split('.')
+                    referenced_labels.append( ref_keypath[0] )
+                    param_template.append( (k_str[:-1].split('.'), ref_keypath, None) )
                 else:                                   # just a verbatim value, possibly structural
-                    m_keypath   = k_str.split('.')
-                    m_value     = param_layer[k_str]
+                    param_template.append( (k_str.split('.'), None, param_layer[k_str]) )
+
+        begin_with_keypath = None
+        if (type(begin_with) == str) and begin_with.startswith(':'):
+            begin_with_keypath = begin_with[1:].split('.')
+            referenced_labels.append( begin_with_keypath[0] )
+
+        if begin_with or not branches:
+            branches.append( { 'link_idxs': [], 'depends_on': set() } )
+        branch_idx = len(branches)-1
+        branches[branch_idx]['link_idxs'].append( curr_link_idx )
+
+        label_refs = { ref_label: label_2_link_idx[ref_label] for ref_label in referenced_labels if ref_label in label_2_link_idx }
+        for producer_idx in label_refs.values():
+            producer_branch_idx = link_plans[producer_idx]['branch_idx']
+            if producer_branch_idx != branch_idx:
+                branches[branch_idx]['depends_on'].add( producer_branch_idx )
+
+        link_plans.append( {
+            'begin_with':           begin_with,
+            'begin_with_keypath':   begin_with_keypath,
+            'help_start':           curr_link_idx==0 and not begin_with and method=='help' and pos_params==[] and param_layers in ([], [{}]),
+            'label':                curr_link.get('label'),
+            'method':               method,
+            'pos_params':           pos_params,
+            'param_template':       param_template,
+            'branch_idx':           branch_idx,
+            'iteration_mode':       iteration_mode,
+            'parallel':             parallel,
+            'max_workers':          max_workers,
+            'label_refs':           label_refs,
+            'bound_labels':         [ ref_label for ref_label in referenced_labels if ref_label not in label_refs ],
+        } )
+
+        if curr_link.get('label') != None:
+            label_2_link_idx[ curr_link['label'] ] = curr_link_idx
+
+    return {
+        'link_plans':   link_plans,
+        'branches':     branches,
+    }
 
-                m_ptr, m_last_syll = traverse(merged_params, m_keypath, False)
-                if m_last_syll == '':
-                    m_ptr.update(m_value)
-                else:
-                    m_ptr[m_last_syll] = m_value
 
-        ## FIXME: A naive approach, assumes ,{ is only used once and stays until reset
+def bind_link(link_plan, curr_entry_object, bindings, link_results, wc):
+    """ Find the object the link starts from and bind the link's parameters,
+        given the results of the links that have run so far (and the external bindings).
+    """
+    from copy import deepcopy
+
+    begin_with      = link_plan['begin_with']
+
+    ## Only the labelled results this link refers to, each one from its latest producer (or bound from outside):
+    #
+    result_cache    = { ref_label: bindings[ref_label] for ref_label in link_plan['bound_labels'] if ref_label in bindings }
+    result_cache.update( { ref_label: link_results[producer_idx] for ref_label, producer_idx in link_plan['label_refs'].items() } )
+
+    ## Re-start if explicitly required:
+    #
+    if begin_with:
+        if link_plan['begin_with_keypath']:                                         # fetch the cached value
+            curr_entry_object = traverse(result_cache, list(link_plan['begin_with_keypath']))
+        elif begin_with == ',,':                                                    # restart from wc
+            curr_entry_object   = wc
+        else:                                                                       # or use the given value
+            curr_entry_object = begin_with
         #
-        if iteration_mode:
-            result_list = []
-            for entry_object in curr_entry_object:
-                result_list.append( entry_object.call(method, merged_params, pos_params) )
-            result = result_list
+        # we'll deal with possible class/cardinality mismatches later ...
+    elif link_plan['help_start']:
+        curr_entry_object   = wc.call('byname', {'entry_name': 'cli_parser3'})
+    #
+    # otherwise just stay with curr_entry_object ...
+
+    ## Applying the pre-split edits:
+    #
+    merged_params = {}
+    for m_keypath, ref_keypath, m_value in link_plan['param_template']:
+        if ref_keypath:
+            m_value = traverse(result_cache, list(ref_keypath))
+        elif type(m_value) in (dict, list):     # the plan is reused, so every run gets its own copy to mutate
+            m_value = deepcopy(m_value)
+
+        m_ptr, m_last_syll = traverse(merged_params, list(m_keypath), False)
+        if m_last_syll == '':
+            m_ptr.update(m_value)
         else:
-            result = curr_entry_object.call(method, merged_params, pos_params)
+            m_ptr[m_last_syll] = m_value
+
+    return curr_entry_object, merged_params
+
+
+def run_plan(plan, bindings=None, parallel_branches=None, __kernel__=None):
+    """ Run a prepared pipeline plan and return the result of its last link.
 
-        if label != None:
-            result_cache[label] = result
+        The bindings provide the values of the labels that are referenced but not produced by the pipeline.
 
-        curr_entry_object = result
+        With parallel_branches (or kernel's parallel_branches) the branches that start at a restart (,, or ,:label)
+        run concurrently, each one waiting only for the branches whose labelled results it refers to.
+        The final result is the same as that of the sequential execution.
+    """
+
+    from types import GeneratorType
+
+    wc                  = __kernel__.working_collection()
+    link_plans          = plan['link_plans']
+    branches            = plan['branches']
+    bindings            = bindings or {}
+    link_results        = {}
+
+    if parallel_branches==None:
+        parallel_branches = __kernel__.parallel_branches
+
+    def run_branch(branch, dependency_futures=None):
+        for dependency_future in dependency_futures or []:
+            dependency_future.result()
+
+        curr_entry_object   = wc
+
+        for curr_link_idx in branch['link_idxs']:
+            link_plan       = link_plans[curr_link_idx]
+            iteration_mode  = link_plan['iteration_mode']
+            parallel        = link_plan['parallel']
+            max_workers     = link_plan['max_workers']
+            label           = link_plan['label']
+            method          = link_plan['method']
+            pos_params      = link_plan['pos_params']
+
+            curr_entry_object, merged_params = bind_link(link_plan, curr_entry_object, bindings, link_results, wc)
+
+            ## FIXME: A naive approach, assumes ,{ is only used once and stays until reset
+            #
+            if iteration_mode and parallel=='async':
+                result = async_calls(curr_entry_object, method, merged_params, pos_params, max_workers, __kernel__)
+            elif iteration_mode and parallel:
+                result = parallel_calls(curr_entry_object, method, merged_params, pos_params, parallel, max_workers)
+            elif iteration_mode and isinstance(curr_entry_object, GeneratorType):  # streaming: stay lazy until the end of the branch
+                result = lazy_calls(curr_entry_object, method, merged_params, pos_params)
+            elif iteration_mode:
+                result_list = []
+                for entry_object in curr_entry_object:
+                    result_list.append( entry_object.call(method, merged_params, pos_params) )
+                result = result_list
+            else:
+                result = curr_entry_object.call(method, merged_params, pos_params)
+
+            if isinstance(result, GeneratorType) and (label != None or curr_link_idx == branch['link_idxs'][-1]):
+                result = list(result)           # a labelled result may be consumed more than once, and a branch's result must be complete
+
+            link_results[curr_link_idx] = result
+            curr_entry_object = result
+
+        return result
+
+    if parallel_branches and len(branches)>1:
+        from concurrent.futures import ThreadPoolExecutor
+
+        # every branch gets its own thread, so waiting for the earlier-submitted dependencies cannot deadlock:
+        with ThreadPoolExecutor(max_workers=len(branches)) as pool:
+            branch_futures = []
+            for branch in branches:
+                dependency_futures = [ branch_futures[dependency_idx] for dependency_idx in sorted(branch['depends_on']) ]
+                branch_futures.append( pool.submit(run_branch, branch, dependency_futures) )
+
+            for branch_future in branch_futures:    # re-raise the first failure in pipeline order
+                result = branch_future.result()
+    else:
+        for branch in branches:
+            result = run_branch(branch)
 
     return result
 
 
+def execute(pipeline, parallel_branches=None, __kernel__=None):
+    """ Execute the pipeline and return the result of its last link.
+        To run the same pipeline many times, prepare() it once and run_plan() it with different bindings instead.
+    """
+
+    #import sys
+    #sys.path.append( __kernel__.get_kernel_path() )
+    #import utils
+
+    return run_plan( prepare(pipeline), parallel_branches=parallel_branches, __kernel__=__kernel__ )
+
+
+async def arun_plan(plan, bindings=None, max_concurrency=None, __kernel__=None):
+    """ Run a prepared pipeline plan asynchronously and return the result of its last link.
+
+        All the branches run concurrently (each one waiting only for the branches it depends on),
+        coroutine methods are awaited natively and the synchronous ones are offloaded to threads,
+        with at most max_concurrency (or kernel's async_concurrency) calls in flight at any moment across all the branches.
+        Iterating links (,{) apply their method to all the elements at once.
+    """
+    import asyncio
+    from types import GeneratorType
+    from concurrent.futures import ThreadPoolExecutor
+
+    wc                  = __kernel__.working_collection()
+    link_plans          = plan['link_plans']
+    bindings            = bindings or {}
+    link_results        = {}
+    max_concurrency     = max_concurrency or __kernel__.async_concurrency
+    semaphore           = asyncio.Semaphore(max_concurrency)
+
+    async def arun_branch(branch, dependency_tasks, executor):
+        await asyncio.gather(*dependency_tasks)
+
+        curr_entry_object   = wc
+
+        for curr_link_idx in branch['link_idxs']:
+            link_plan       = link_plans[curr_link_idx]
+            method          = link_plan['method']
+            pos_params      = link_plan['pos_params']
+
+            curr_entry_object, merged_params = bind_link(link_plan, curr_entry_object, bindings, link_results, wc)
+
+            if link_plan['iteration_mode']:
+                result = await gather_calls(curr_entry_object, method, merged_params, pos_params, executor=executor, semaphore=semaphore)
+            else:
+                async with semaphore:
+                    result = await curr_entry_object.acall(method, merged_params, pos_params, executor=executor)
+
+            if isinstance(result, GeneratorType):
+                result = list(result)
+
+            link_results[curr_link_idx] = result
+            curr_entry_object = result
+
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        branch_tasks = []
+        for branch in plan['branches']:
+            dependency_tasks = [ branch_tasks[dependency_idx] for dependency_idx in sorted(branch['depends_on']) ]
+            branch_tasks.append( asyncio.ensure_future( arun_branch(branch, dependency_tasks, executor) ) )
+
+        branch_results = await asyncio.gather(*branch_tasks)
+
+    return branch_results[-1]
+
+
+def aexecute(pipeline, max_concurrency=None, __kernel__=None):
+    """ Execute the pipeline asynchronously (see arun_plan) and return the result of its last link.
+
+        Usage example:
+            clip byname --entry_name=pipeliner3 , aexecute --pipeline.method=show_map
+    """
+    import asyncio
+
+    return asyncio.run( arun_plan(prepare(pipeline), max_concurrency=max_concurrency, __kernel__=__kernel__) )
+
+
 if __name__ == '__main__':
 
     ## When the entry's code is run as a script, perform local tests:
@@ -115,6 +407,26 @@ if __name__ == '__main__':
     sys.path.append( dn(dn(dn(__file__))) )
     from class_entry import default_kernel_instance as kernel
 
+    ## Two independent branches run via clip, sequentially and (with CLIP_PARALLEL_BRANCHES set) concurrently:
+    #
+    import os
+    import time
+    import subprocess
+
+    clip_path       = kernel.get_kernel_path('clip')
+    two_branches    = [ 'byname', '--entry_name=system_cmd', ',', 'run', '--shell_cmd=sleep 0.5', ',,', 'byname', '--entry_name=system_cmd', ',', 'run', '--shell_cmd=sleep 0.5' ]
+    branch_env      = { k: v for k, v in os.environ.items() if k not in ('CLIP_SOCKET', 'CLIP_PARALLEL_BRANCHES') }
+    branch_results  = {}
+    for parallel_branches in ('0', '1'):
+        start_time  = time.time()
+        output      = subprocess.run([sys.executable, clip_path] + two_branches, env=dict(branch_env, CLIP_PARALLEL_BRANCHES=parallel_branches),
+                                     stdout=subprocess.PIPE, universal_newlines=True).stdout
+        branch_results[parallel_branches] = (time.time() - start_time, output.splitlines()[-1])
+    print("BRANCHES via clip: {:.2f}s sequentially, {:.2f}s concurrently{}{}".format(branch_results['0'][0], branch_results['1'][0],
+            '' if branch_results['0'][1]==branch_results['1'][1] else ', RESULTS DIFFER: {} vs {}'.format(branch_results['0'][1], branch_results['1'][1]),
+            '' if branch_results['1'][0] < branch_results['0'][0] - 0.3 else ', NOT CONCURRENT'))
+    print('='*60)
+
     execute({ 'method': 'show_map' }, __kernel__=kernel)
     print('='*60)
     execute([{'method': 'byname', 'params': {'entry_name': 'params_entry'} }, {'method': 'show' }], __kernel__=kernel)
@@ -1,19 +1,605 @@
 #!/usr/bin/env python3
 
 """ Find a given entry_name in the given or stored index
+
+    A collection normally keeps its name_2_path in its own parameters and each entry's parameters in the entry's directory.
+    A large collection can keep all of them in an SQLite database instead, where byquery runs as (indexed) SQL:
+        clip add_entry --entry_name=big_collection --data.storage=sqlite --data.indexed_parameters,=number --data.parent_entry_name=core_collection
+        clip byname --entry_name=big_collection , import_collection --source_path=big.jsonl.gz
+        clip byname --entry_name=big_collection , byquery odd,number<100 ,{ get_name
 """
 
 
-def show_map(name_2_path):
+import re
+
+## Query compilation: pre-compiled regular expressions, the comparison functions and the cache of compiled queries:
+#
+_binary_op_regex    = re.compile(r'([\w\.]*\w)(=|==|!=|<>|<|>|<=|>=|:|!:)(-?[\w\.]+)$')
+_unary_op_regex     = re.compile(r'([\w\.]*\w)(\.|\?)$')
+_tag_regex          = re.compile(r'([!^-])?(\w+)$')
+
+_op_2_cost_and_fun  = {     # the cheaper and the more selective checks get applied first
+    '.':    (0, lambda x, y: x!=None),
+    '?':    (1, lambda x, y: bool(x)),
+    '=':    (2, lambda x, y : x==y),
+    '==':   (2, lambda x, y : x==y),
+    '<':    (3, lambda x, y : x!=None and x<y),
+    '>':    (3, lambda x, y : x!=None and x>y),
+    '<=':   (3, lambda x, y : x!=None and x<=y),
+    '>=':   (3, lambda x, y : x!=None and x>=y),
+    ':':    (4, lambda x, y : type(x)==list and y in x),
+    '!=':   (5, lambda x, y : x!=y),
+    '<>':   (5, lambda x, y : x!=y),
+    '!:':   (6, lambda x, y : type(x)==list and y not in x),
+}
+
+_compiled_queries   = {}
+
+
+def _traverse_and_apply(key_path, fun, against=None):
+    """ Finally, a useful real-life example of closures:
+        captures both *fun* and *against* in the internal function.
+    """
+
+    def traverse(entry):
+        struct_ptr = entry.parameters_loaded()
+        for key_syllable in key_path:
+            if type(struct_ptr)==dict and (key_syllable in struct_ptr):
+                struct_ptr = struct_ptr[key_syllable]   # iterative descent
+            elif type(struct_ptr)==list:
+                idx = None
+                try:
+                    idx = int(key_syllable)
+                except:
+                    pass
+
+                if type(idx)==int and 0<=idx<len(struct_ptr):
+                    struct_ptr = struct_ptr[idx]
+                else:
+                    return None
+            else:
+                return None
+
+        return fun(struct_ptr, against)
+
+    return traverse
+
+
+def _to_num_or_not_to_num(x):
+    "Convert the parameter to a number if it looks like it"
+
+    try:
+        x_int = int(x)
+        if type(x_int)==int:
+            return x_int
+    except:
+        try:
+            x_float = float(x)
+            if type(x_float)==float:
+                return x_float
+        except:
+            pass
+
+    return x
+
+
+def compile_query(query):
+    """ Turn a query string into a reusable query plan: the sets of positive and negative tags
+        plus the list of checks, ordered by their estimated cost and selectivity.
+        Compiled plans are cached by the query string.
+    """
+
+    compiled_query = _compiled_queries.get(query)
+    if compiled_query:
+        return compiled_query
+
+    positive_tags_set   = set()
+    negative_tags_set   = set()
+    costed_check_list   = []
+    conditions          = []    # (key_path, op, test_val) , for the storage backends that can evaluate them natively
+
+    for condition in query.split(','):
+        binary_op_match = _binary_op_regex.match(condition)
+        if binary_op_match:
+            key_path    = binary_op_match.group(1).split('.')
+            test_val    = _to_num_or_not_to_num(binary_op_match.group(3))
+            cost, fun   = _op_2_cost_and_fun[binary_op_match.group(2)]
+            costed_check_list.append( ((cost, len(key_path)), _traverse_and_apply(key_path, fun, test_val)) )
+            conditions.append( (key_path, binary_op_match.group(2), test_val) )
+        else:
+            unary_op_match = _unary_op_regex.match(condition)
+            if unary_op_match:
+                key_path    = unary_op_match.group(1).split('.')
+                cost, fun   = _op_2_cost_and_fun[unary_op_match.group(2)]
+                costed_check_list.append( ((cost, len(key_path)), _traverse_and_apply(key_path, fun)) )
+                conditions.append( (key_path, unary_op_match.group(2), None) )
+            else:
+                tag_match = _tag_regex.match(condition)
+                if tag_match:
+                    if tag_match.group(1):
+                        negative_tags_set.add( tag_match.group(2) )
+                    else:
+                        positive_tags_set.add( tag_match.group(2) )
+                else:
+                    raise(SyntaxError("Could not parse the condition '{}'".format(condition)))
+
+    compiled_query = {
+        'positive_tags_set':    positive_tags_set,
+        'negative_tags_set':    negative_tags_set,
+        'check_list':           [ check for _, check in sorted(costed_check_list, key=lambda pair: pair[0]) ],
+        'conditions':           conditions,
+    }
+    _compiled_queries[query] = compiled_query
+
+    return compiled_query
+
+
+def show_map(name_2_path, __entry__=None):
     """ Show the whole name_2_path index of this collection.
     """
 
     from pprint import pprint
-    pprint(name_2_path)
+    pprint(_collection_name_2_path(__entry__) if __entry__ else name_2_path)
+
+
+## In-memory copies of persisted tag indices, keyed by the real path of their collection:
+#
+_tag_indices = {}
+
+
+def _parameters_file_stamp(__entry__, __kernel__, relative_path):
+    "The path of the entry's parameters file and its stamp (in the form kept by the tag index), without reading the file"
+
+    import os
+    import utils
+
+    parameters_rel_path, _ = __kernel__.parameters_location
+    parameters_path = __entry__.get_path( os.path.join(relative_path, parameters_rel_path) )
+    stamp           = utils.file_stamp( parameters_path )
+
+    return parameters_path, (list(stamp) if stamp else None)
+
+
+def _own_parameters_with_stamp(__entry__, __kernel__, relative_path):
+    "Read the entry's own parameters straight from its file, along with the file's stamp (taken first, so that a concurrent change is noticed later)"
+
+    import utils
+
+    parameters_path, stamp = _parameters_file_stamp(__entry__, __kernel__, relative_path)
+    own_parameters, found  = utils.quietly_load_json_config( parameters_path, __kernel__.parameters_location[1] )
+
+    return (own_parameters if found else {}), stamp
+
+
+def _load_tag_index(__entry__, __kernel__, revalidate=True):
+    """ Get the inverted tag index of this collection (from memory, from its sidecar file or by building it).
+        Only the entries' own tags are indexed, along with the stamps of their parameter files,
+        and the entries that inherit their tags are simply marked as such (their tags are resolved at query time).
+        The index is rebuilt from the collection's parameters file when it changes,
+        and (unless revalidate is False) the entries whose parameters files have changed since they were indexed get re-read.
+        Changing the index without revalidating it is fine: the outdated stamps are still there for the next query to notice.
+    """
+    import os
+    import json
+
+    collection_real_path    = os.path.realpath( __entry__.get_path() )
+    index_file_path         = __entry__.get_path('.tag_index.json')
+    stamp                   = _json_stamp( __kernel__.entry_stamp(collection_real_path) )
+
+    index = _tag_indices.get(collection_real_path)
+    if index==None and os.path.isfile(index_file_path):
+        with open(index_file_path) as index_file:
+            index = json.load(index_file)
+        if 'path_2_stamp' in index:     # otherwise written by an older version, which indexed the effective tags
+            index['tag_2_paths']    = { tag: set(paths) for tag, paths in index['tag_2_paths'].items() }
+            index['inheriting']     = set(index['inheriting'])
+        else:
+            index = None
+
+    if index==None or index['stamp']!=stamp:
+        print("COLLECTION.tag_index() building for {} ...".format(collection_real_path))
+
+        # The name_2_path of the collection object may be older than its file, so the file is read after taking its stamp:
+        #
+        collection_parameters, _ = _own_parameters_with_stamp(__entry__, __kernel__, '')
+        name_2_path = collection_parameters.get('name_2_path', __entry__['name_2_path']) or {}
+
+        index = { 'path_2_tags': {}, 'tag_2_paths': {}, 'inheriting': set(), 'path_2_stamp': {} }
+        for relative_path in name_2_path.values():
+            _tag_index_entry(index, relative_path, *_own_parameters_with_stamp(__entry__, __kernel__, relative_path))
+        _store_tag_index(__entry__, __kernel__, index, stamp)
+    elif revalidate:
+        index_changed = False
+        for relative_path, entry_stamp in list( index['path_2_stamp'].items() ):
+            if _parameters_file_stamp(__entry__, __kernel__, relative_path)[1]!=entry_stamp:    # only the changed ones get read
+                index_changed = _tag_index_entry(index, relative_path, *_own_parameters_with_stamp(__entry__, __kernel__, relative_path)) or index_changed
+        if index_changed:
+            _store_tag_index(__entry__, __kernel__, index, stamp)
+
+    _tag_indices[collection_real_path] = index
+    return index
+
+
+def _store_tag_index(__entry__, __kernel__, index, stamp=None):
+    """ Save the tag index into its sidecar file, as the index of the collection's parameters in the state given by stamp
+        (the current state if None, after the collection has changed them itself).
+    """
+    import os
+    import utils
+
+    index['stamp'] = stamp or _json_stamp( __kernel__.entry_stamp(os.path.realpath( __entry__.get_path() )) )
+    utils.store_structure_to_json_file({
+            'stamp':        index['stamp'],
+            'path_2_tags':  index['path_2_tags'],
+            'tag_2_paths':  { tag: sorted(paths) for tag, paths in index['tag_2_paths'].items() },
+            'inheriting':   sorted(index['inheriting']),
+            'path_2_stamp': index['path_2_stamp'],
+        }, __entry__.get_path('.tag_index.json'), json_indent=None)
+
+
+def _tag_index_set(index, relative_path, tags):
+    "(Re)place the relative_path into the index under the given tags (None removes it). Returns True if anything changed."
+
+    import os
+
+    relative_path   = os.path.normpath( relative_path )
+    old_tags        = index['path_2_tags'].get(relative_path)
+    if tags==None:
+        index['inheriting'].discard( relative_path )
+        index['path_2_stamp'].pop( relative_path, None )
+    if old_tags==tags:
+        return False
+
+    for tag in old_tags or []:
+        index['tag_2_paths'][tag].discard( relative_path )
+        if not index['tag_2_paths'][tag]:
+            del index['tag_2_paths'][tag]
+
+    if tags==None:
+        del index['path_2_tags'][relative_path]
+    else:
+        index['path_2_tags'][relative_path] = list(tags)
+        for tag in tags:
+            index['tag_2_paths'].setdefault(tag, set()).add( relative_path )
+
+    return True
+
+
+def _tag_index_entry(index, relative_path, own_parameters, stamp):
+    """ Index the entry by its own tags, or mark it as inheriting them if it has none of its own but has a parent,
+        and remember the stamp of its parameters file. Returns True if anything changed.
+    """
+    import os
+
+    relative_path   = os.path.normpath( relative_path )
+    inheriting      = 'tags' not in own_parameters and bool(own_parameters.get('parent_entry_name'))
+    index_changed   = _tag_index_set(index, relative_path, [] if inheriting else (own_parameters.get('tags') or []))
+
+    if inheriting != (relative_path in index['inheriting']):
+        (index['inheriting'].add if inheriting else index['inheriting'].discard)( relative_path )
+        index_changed = True
+    if index['path_2_stamp'].get(relative_path)!=stamp:
+        index['path_2_stamp'][relative_path] = stamp
+        index_changed = True
+
+    return index_changed
+
+
+def reindex_entry(entry_object, __entry__=None, __kernel__=None):
+    """ Bring the tag index of this collection up to date with the given entry's own tags.
+        Called by Entry.update() on entries that know which collection they belong to.
+    """
+    import os
+
+    if _parameters_store(__entry__):    # the store keeps the tags current by itself
+        return
+
+    relative_path   = os.path.relpath( os.path.realpath(entry_object.get_path()), os.path.realpath(__entry__.get_path()) )
+    index           = _load_tag_index(__entry__, __kernel__, revalidate=False)
+
+    if relative_path in index['path_2_tags'] and _tag_index_entry(index, relative_path, *_own_parameters_with_stamp(__entry__, __kernel__, relative_path)):
+        _store_tag_index(__entry__, __kernel__, index, index['stamp'])
+
+
+def tag_index(__entry__=None, __kernel__=None):
+    """ Show the inverted tag index of this collection.
+
+        Usage example:
+            clip byname --entry_name=words_collection , tag_index
+    """
+
+    store = _parameters_store(__entry__)
+    if store:
+        own_tag_2_paths, inheriting = store.tag_index(), store.inheriting_paths()
+    else:
+        tag_index = _load_tag_index(__entry__, __kernel__)
+        own_tag_2_paths, inheriting = tag_index['tag_2_paths'], tag_index['inheriting']
+
+    effective_tag_2_paths = { tag: set(paths) for tag, paths in own_tag_2_paths.items() }
+    for relative_path in inheriting:
+        for tag in _collection_member(__entry__, __kernel__, relative_path, store)['tags'] or []:
+            effective_tag_2_paths.setdefault(tag, set()).add( relative_path )
+
+    return { tag: sorted(paths) for tag, paths in effective_tag_2_paths.items() }
+
+
+## SQLite-backed storage of the entries' parameters, for the collections that declare "storage": "sqlite"
+#  (the stores that are open get registered in the kernel's parameters_stores) :
+#
+_numeric_json_types = ('integer', 'real', 'true', 'false')
+
+
+class SQLiteParametersStore:
+    """ Keeps the own parameters of all the entries of a collection (and its name_2_path) in one SQLite database
+        within the collection's directory, with an indexed table of the entries' own tags next to them
+        (and a table of the entries that inherit their tags instead, to be resolved at query time).
+        Every write gives the row a new version, so that the copies of the parameters loaded before can be told outdated.
+
+        Entry objects of such a collection use it through their parameters_store hook,
+        so that parameters_loaded(), update() and get_path() work as usual (the entry directories only exist if they hold files).
+        Parameters listed in the collection's "indexed_parameters" get expression indices for byquery.
+    """
+
+    def __init__(self, collection_path, indexed_parameters=None):
+        import os
+        import json
+        import threading
+
+        self.collection_path    = os.path.realpath(collection_path)
+        self.db_path            = os.path.join(self.collection_path, '.entries.sqlite')
+        self.thread_local       = threading.local()     # sqlite3 connections cannot be shared between threads
+
+        with self.connection() as connection:
+            connection.execute( 'CREATE TABLE IF NOT EXISTS entries (entry_name TEXT PRIMARY KEY, relative_path TEXT UNIQUE NOT NULL, parameters TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 0)' )
+            connection.execute( 'CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, relative_path TEXT NOT NULL, PRIMARY KEY (tag, relative_path)) WITHOUT ROWID' )
+            connection.execute( 'CREATE INDEX IF NOT EXISTS tags_by_path ON tags (relative_path)' )
+            connection.execute( 'CREATE TABLE IF NOT EXISTS inheriting (relative_path TEXT PRIMARY KEY) WITHOUT ROWID' )
+            for key_path in indexed_parameters or []:
+                connection.execute( 'CREATE INDEX IF NOT EXISTS "by_{}" ON entries ({})'.format( key_path, self.json_extract_sql(key_path.split('.')) ) )
+
+        if self.connection().execute( 'PRAGMA user_version' ).fetchone()[0] < 1:
+            connection = self.connection()
+            connection.execute( 'BEGIN IMMEDIATE' )     # one process at a time, and the check is repeated under the lock
+            try:
+                if connection.execute( 'PRAGMA user_version' ).fetchone()[0] < 1:   # made by the version that had no row versions and kept the effective tags
+                    if 'version' not in [ column[1] for column in connection.execute( 'PRAGMA table_info(entries)' ) ]:
+                        connection.execute( 'ALTER TABLE entries ADD COLUMN version INTEGER NOT NULL DEFAULT 0' )
+                    connection.execute( 'DELETE FROM tags' )
+                    for relative_path, parameters in connection.execute( 'SELECT relative_path, parameters FROM entries' ).fetchall():
+                        self.set_tags(connection, relative_path, json.loads(parameters))
+                    connection.execute( 'PRAGMA user_version = 1' )
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+
+
+    def connection(self):
+        import sqlite3
+
+        connection = getattr(self.thread_local, 'connection', None)
+        if connection==None:
+            connection = self.thread_local.connection = sqlite3.connect(self.db_path, timeout=30)
+        return connection
+
+
+    def relative_path(self, entry_object):
+        import os
+
+        return os.path.relpath( os.path.realpath(entry_object.get_path()), self.collection_path )
+
+
+    @staticmethod
+    def new_version():
+        "A version for the rows being written now: the time in ns, never repeated for the same row in practice"
+
+        import time
+
+        return time.time_ns()
+
+
+    def load_parameters(self, entry_object):
+        import json
+
+        row = self.connection().execute( 'SELECT parameters, version FROM entries WHERE relative_path=?', (self.relative_path(entry_object),) ).fetchone()
+        entry_object.stored_version = row and row[1]
+        return json.loads(row[0]) if row else {}
+
+
+    def stored_version(self, entry_object):
+        "The current version of the entry's parameters in the database (None if it is not there)"
+
+        row = self.connection().execute( 'SELECT version FROM entries WHERE relative_path=?', (self.relative_path(entry_object),) ).fetchone()
+        return row and row[0]
+
+
+    def store_parameters(self, entry_object, parameters):
+        import json
+
+        relative_path   = self.relative_path(entry_object)
+        version         = self.new_version()
+        with self.connection() as connection:   # one transaction
+            connection.execute( 'UPDATE entries SET parameters=?, version=? WHERE relative_path=?', (json.dumps(parameters), version, relative_path) )
+            self.set_tags(connection, relative_path, parameters)
+        entry_object.stored_version = version
+
+
+    def set_tags(self, connection, relative_path, parameters):
+        "Index the entry by its own tags, or list it among the inheriting ones if it has none of its own but has a parent"
+
+        connection.execute( 'DELETE FROM tags WHERE relative_path=?', (relative_path,) )
+        connection.execute( 'DELETE FROM inheriting WHERE relative_path=?', (relative_path,) )
+        if 'tags' not in parameters and parameters.get('parent_entry_name'):
+            connection.execute( 'INSERT INTO inheriting (relative_path) VALUES (?)', (relative_path,) )
+        else:
+            connection.executemany( 'INSERT OR IGNORE INTO tags (tag, relative_path) VALUES (?, ?)', [ (tag, relative_path) for tag in parameters.get('tags') or [] ] )
+
+
+    def add_entries(self, records):
+        "Add (entry_name, relative_path, parameters) records in one transaction"
+
+        import json
+
+        version = self.new_version()
+        with self.connection() as connection:
+            for entry_name, relative_path, parameters in records:
+                connection.execute( 'INSERT OR REPLACE INTO entries (entry_name, relative_path, parameters, version) VALUES (?, ?, ?, ?)', (entry_name, relative_path, json.dumps(parameters), version) )
+                self.set_tags(connection, relative_path, parameters)
+
+
+    def delete_entries(self, entry_names):
+        "Delete the named entries in one transaction, return their relative paths"
+
+        relative_paths = [ self.lookup(entry_name) for entry_name in entry_names ]
+        if None in relative_paths:
+            raise KeyError( entry_names[ relative_paths.index(None) ] )
+
+        with self.connection() as connection:
+            connection.executemany( 'DELETE FROM entries WHERE entry_name=?', [ (entry_name,) for entry_name in entry_names ] )
+            connection.executemany( 'DELETE FROM tags WHERE relative_path=?', [ (relative_path,) for relative_path in relative_paths ] )
+            connection.executemany( 'DELETE FROM inheriting WHERE relative_path=?', [ (relative_path,) for relative_path in relative_paths ] )
+
+        return relative_paths
+
+
+    def lookup(self, entry_name):
+        row = self.connection().execute( 'SELECT relative_path FROM entries WHERE entry_name=?', (entry_name,) ).fetchone()
+        return row and row[0]
+
+
+    def name_2_path(self):
+        return dict( self.connection().execute( 'SELECT entry_name, relative_path FROM entries ORDER BY rowid' ) )
+
+
+    def inheriting_paths(self):
+        return [ relative_path for (relative_path,) in self.connection().execute( 'SELECT relative_path FROM inheriting' ) ]
+
+
+    def tag_index(self):
+        "The entries' own tags only"
+
+        tag_2_paths = {}
+        for tag, relative_path in self.connection().execute( 'SELECT tag, relative_path FROM tags ORDER BY tag, relative_path' ):
+            tag_2_paths.setdefault(tag, []).append( relative_path )
+        return tag_2_paths
+
+
+    @staticmethod
+    def json_extract_sql(key_path):
+        "The SQL expression for the value under the key path (the syllables are \\w+ , so they can be inlined, and an expression index can match it)"
+
+        return "json_extract(parameters, '$.{}')".format( '.'.join( '"{}"'.format(key_syllable) for key_syllable in key_path ) )
+
+
+    def query(self, compiled_query):
+        """ Narrow the entries down to the candidates for the compiled query, using the indices as much as possible.
+            Returns the (relative_path, parameters, version) triplets of the candidates.
+
+            The tags and most of the conditions are translated into SQL. The conditions whose key paths contain list indices
+            (or whose meaning SQL cannot reproduce exactly) are left to the usual checks that run on all the candidates anyway.
+        """
+        import json
+
+        where_clauses   = []
+        sql_params      = []
+
+        for tag in sorted(compiled_query['positive_tags_set']):    # the entries that inherit their tags are checked later
+            where_clauses.append( 'relative_path IN (SELECT relative_path FROM tags WHERE tag=? UNION ALL SELECT relative_path FROM inheriting)' )
+            sql_params.append( tag )
+        for tag in sorted(compiled_query['negative_tags_set']):
+            where_clauses.append( 'relative_path NOT IN (SELECT relative_path FROM tags WHERE tag=?)' )
+            sql_params.append( tag )
+
+        for key_path, op, test_val in compiled_query['conditions']:
+            if any( key_syllable.isdigit() for key_syllable in key_path ):     # could be a list index as well as a dictionary key
+                continue
+
+            value_sql   = self.json_extract_sql(key_path)
+            type_sql    = value_sql.replace('json_extract', 'json_type', 1)
+            if op in ('.', '?'):                # for '?' it is only a necessary condition
+                where_clauses.append( "{} NOT IN ('null')".format(type_sql) )
+            elif op in ('=', '=='):
+                where_clauses.append( '{} = ?'.format(value_sql) )
+                sql_params.append( test_val )
+            elif op in ('<', '>', '<=', '>='):  # only comparable types may match
+                if type(test_val)==str:
+                    where_clauses.append( "{} = 'text' AND {} {} ?".format(type_sql, value_sql, op) )
+                else:
+                    where_clauses.append( "{} IN {} AND {} {} ?".format(type_sql, _numeric_json_types, value_sql, op) )
+                sql_params.append( test_val )
+            elif op == ':':
+                where_clauses.append( "{} = 'array' AND EXISTS (SELECT 1 FROM json_each(parameters, '$.{}') WHERE value = ?)".format(
+                    type_sql, '.'.join( '"{}"'.format(key_syllable) for key_syllable in key_path ) ) )
+                sql_params.append( test_val )
+            # the negative conditions are left to the checks
+
+        sql = 'SELECT relative_path, parameters, version FROM entries' + (' WHERE '+' AND '.join(where_clauses) if where_clauses else '') + ' ORDER BY rowid'
+
+        return [ (relative_path, json.loads(parameters), version) for relative_path, parameters, version in self.connection().execute(sql, sql_params) ]
+
+
+def _parameters_store(__entry__):
+    "The store of the entries' parameters, if this collection keeps them in a database rather than in their own files"
+
+    import os
+
+    own_parameters = __entry__.parameters_loaded()     # the storage is not inherited
+    if own_parameters.get('storage')!='sqlite':
+        return None
 
+    collection_real_path    = os.path.realpath( __entry__.get_path() )
+    parameters_stores       = __entry__.kernel.parameters_stores
+    store = parameters_stores.get(collection_real_path)
+    if store==None:
+        store = parameters_stores[collection_real_path] = SQLiteParametersStore(collection_real_path, own_parameters.get('indexed_parameters'))
+    return store
 
-def byquery(query, name_2_path, collections_searchpath, __entry__=None, __kernel__=None):
-    """ Find all objects matching the query
+
+def entries_parameters_store(__entry__=None):
+    "The store of the entries' parameters, if this collection keeps them in a database (see SQLiteParametersStore), otherwise None"
+
+    return _parameters_store(__entry__)
+
+
+def _collection_member(__entry__, __kernel__, relative_path, store=None, parameters=None, version=None):
+    """ Load the entry found in this collection, and let it know where it belongs and where its parameters are kept.
+        The parameters of a cached entry are dropped if someone (e.g. another process) has stored a newer version of them since.
+    """
+
+    entry_object = __kernel__.bypath( __entry__.get_path(relative_path) )
+    entry_object.collection_entry = __entry__
+
+    if store and entry_object.parameters_store is not store:
+        entry_object.parameters_store   = store
+        entry_object.own_parameters     = parameters
+        entry_object.stored_version     = version
+        entry_object.parameters_version += 1
+    elif store and entry_object.own_parameters==None:
+        entry_object.own_parameters     = parameters
+        entry_object.stored_version     = version
+    elif store:
+        if version==None:
+            version = store.stored_version(entry_object)
+        if version!=entry_object.stored_version:
+            entry_object.own_parameters     = parameters    # or re-loaded when needed
+            entry_object.stored_version     = version
+            entry_object.parameters_version += 1
+
+    return entry_object
+
+
+def _collection_name_2_path(__entry__):
+    "The collection's name_2_path, wherever it is kept"
+
+    store = _parameters_store(__entry__)
+    return store.name_2_path() if store else (__entry__['name_2_path'] or {})
+
+
+def byquery(query, name_2_path, collections_searchpath, max_workers=None, stream=False, pool=None, __entry__=None, __kernel__=None):
+    """ Find all objects matching the query.
+        Given max_workers (or kernel's scan_workers), batches of candidates are scanned by a thread pool,
+        which is created once at the top and shared with all the subcollections (passed down as pool).
+        With stream=True a generator is returned that yields the matching objects as soon as they are found.
 
         Usage examples:
             clip byquery dictionary,-english  ,{ get_path       # tag 'dictionary' is present while tag 'english' is absent
@@ -27,154 +613,277 @@ def byquery(query, name_2_path, collections_searchpath, __entry__=None, __kernel
             clip byquery solar.planets!:Titan ,{ get_path       #   is a list and does not contain the value Titan
             clip byquery key1.key2.key3.      ,{ get_name       # the path key1.key2.key3 exists
             clip byquery key1.ind2.key3?      ,{ get_path       # the path key1.ind2.key3 converts to True (Python rules)
+            clip byquery dictionary --max_workers=8 ,{ get_path     # scan in parallel
+            clip byquery dictionary --stream ,{ get_path            # start iterating before the scan is over
     """
 
-    def traverse_and_apply(key_path, fun, against=None):
-        """ Finally, a useful real-life example of closures:
-            captures both *fun* and *against* in the internal function.
-        """
+    max_workers = max_workers or __kernel__.scan_workers
 
-        def traverse(entry):
-            struct_ptr = entry.parameters_loaded()
-            for key_syllable in key_path:
-                if type(struct_ptr)==dict and (key_syllable in struct_ptr):
-                    struct_ptr = struct_ptr[key_syllable]   # iterative descent
-                elif type(struct_ptr)==list:
-                    idx = None
-                    try:
-                        idx = int(key_syllable)
-                    except:
-                        pass
-
-                    if type(idx)==int and 0<=idx<len(struct_ptr):
-                        struct_ptr = struct_ptr[idx]
-                    else:
-                        return None
-                else:
-                    return None
+    ## Forming the query:
+    #
+    if type(query)==dict:   # an already compiled query
+        compiled_query  = query
+    else:                   # compiling the query or reusing the cached compilation
+        compiled_query  = compile_query(query)
 
-            return fun(struct_ptr, against)
+    positive_tags_set   = compiled_query['positive_tags_set']
+    negative_tags_set   = compiled_query['negative_tags_set']
+    check_list          = compiled_query['check_list']
 
-        return traverse
+    # Narrowing the candidates down via the tag index, without touching the unmatched entries:
+    #
+    store = _parameters_store(__entry__)
+    candidate_parameters = {}
+    if store:                   # the database does the narrowing (and hands out the candidates' parameters along the way)
+        candidate_parameters    = { relative_path: (parameters, version) for relative_path, parameters, version in store.query(compiled_query) }
+        candidate_paths         = list( candidate_parameters )
+    else:
+        candidate_paths = name_2_path.values()
+    if (positive_tags_set or negative_tags_set) and not store:
+        import os
 
+        tag_index       = _load_tag_index(__entry__, __kernel__)
+        tag_2_paths     = tag_index['tag_2_paths']
+        matching_set    = None
+        for tag in positive_tags_set:
+            matching_set = tag_2_paths.get(tag, set()) if matching_set==None else (matching_set & tag_2_paths.get(tag, set()))
+        if matching_set==None:
+            matching_set = set(tag_index['path_2_tags'])
+        for tag in negative_tags_set:
+            matching_set = matching_set - tag_2_paths.get(tag, set())
+        matching_set = matching_set | tag_index['inheriting']   # their tags are only known once they are loaded
 
-    def to_num_or_not_to_num(x):
-        "Convert the parameter to a number if it looks like it"
+        candidate_paths = [ relative_path for relative_path in candidate_paths if os.path.normpath(relative_path) in matching_set ]
 
-        try:
-            x_int = int(x)
-            if type(x_int)==int:
-                return x_int
-        except:
-            try:
-                x_float = float(x)
-                if type(x_float)==float:
-                    return x_float
-            except:
-                pass
+    # Applying the query:
+    #
+    def matching_objects(relative_paths_batch):
+        "Load and check a batch of candidates, return the matching ones in order"
 
-        return x
+        matching_batch = []
+        for relative_path in relative_paths_batch:
+            candidate_object    = _collection_member(__entry__, __kernel__, relative_path, store, *candidate_parameters.get(relative_path, (None, None)))
+            candidate_tags_set  = set(candidate_object['tags'] or [])
+            if (positive_tags_set <= candidate_tags_set) and negative_tags_set.isdisjoint(candidate_tags_set):
+                candidate_still_ok = True
+                for check in check_list:
+                    if not check(candidate_object):
+                        candidate_still_ok = False
+                        break
+                if candidate_still_ok:
+                    matching_batch.append( candidate_object )
+        return matching_batch
 
+    # Recursion into collections:
+    #
+    subcollection_objects = []
+    for subcollection_name in collections_searchpath or []:
+        if subcollection_name.find('/')>=0:
+            subcollection_object    = __kernel__.bypath(subcollection_name)
+        else:
+            subcollection_local     = store.lookup(subcollection_name) if store else name_2_path.get(subcollection_name)
+            subcollection_object    = __kernel__.byname(subcollection_name, __entry__ if subcollection_local else None)
+        subcollection_objects.append( subcollection_object )
 
-    ## Forming the query:
+    # Only the batches of candidates go to the pool: the subcollections are walked by the caller's thread,
+    # which submits their batches into the same pool, so nobody waits for a task that waits for the pool.
     #
-    if type(query)==dict:   # an already parsed query
-        parsed_query        = query
-        positive_tags_set   = parsed_query.get('positive_tags_set', set())
-        negative_tags_set   = parsed_query.get('negative_tags_set', set())
-        check_list          = parsed_query.get('check_list', [])
-    else:                   # parsing the query for the first time
-        positive_tags_set   = set()
-        negative_tags_set   = set()
-        check_list          = []
-        parsed_query = {
-            'positive_tags_set':    positive_tags_set,
-            'negative_tags_set':    negative_tags_set,
-            'check_list':           check_list,
-        }
-
-        conditions = query.split(',')
-
-        import re
-        for condition in conditions:
-            binary_op_match = re.match('([\w\.]*\w)(=|==|!=|<>|<|>|<=|>=|:|!:)(-?[\w\.]+)$', condition)
-            if binary_op_match:
-                key_path    = binary_op_match.group(1).split('.')
-                test_val    = to_num_or_not_to_num(binary_op_match.group(3))
-                if binary_op_match.group(2) in ('=', '=='):
-                    check_list.append( traverse_and_apply(key_path, lambda x, y : x==y, test_val) )
-                elif binary_op_match.group(2) in ('!=', '<>'):
-                    check_list.append( traverse_and_apply(key_path, lambda x, y : x!=y, test_val) )
-                elif binary_op_match.group(2)=='<':
-                    check_list.append( traverse_and_apply(key_path, lambda x, y : x!=None and x<y, test_val) )
-                elif binary_op_match.group(2)=='>':
-                    check_list.append( traverse_and_apply(key_path, lambda x, y : x!=None and x>y, test_val) )
-                elif binary_op_match.group(2)=='<=':
-                    check_list.append( traverse_and_apply(key_path, lambda x, y : x!=None and x<=y, test_val) )
-                elif binary_op_match.group(2)=='>=':
-                    check_list.append( traverse_and_apply(key_path, lambda x, y : x!=None and x>=y, test_val) )
-                elif binary_op_match.group(2)==':':
-                    check_list.append( traverse_and_apply(key_path, lambda x, y : type(x)==list and y in x, test_val) )
-                elif binary_op_match.group(2)=='!:':
-                    check_list.append( traverse_and_apply(key_path, lambda x, y : type(x)==list and y not in x, test_val) )
+    def shared_pool():
+        "The pool passed down from the top, or a new one for the top to own"
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        return (pool, False) if pool else (ThreadPoolExecutor(max_workers=max_workers), True)
+
+    def subcollection_params(scan_pool, **extra_params):
+        return dict({ 'query': compiled_query, 'max_workers': max_workers, 'pool': scan_pool }, **extra_params)
+
+    def generate_objects_found():
+        "Yield the matching objects lazily, in the same order as the full scan"
+
+        if max_workers and max_workers>1:   # I/O-bound fan-out: batches of candidates are scanned by a thread pool
+            from collections import deque
+
+            candidate_list  = list(candidate_paths)
+            batch_size      = max(1, min(64, len(candidate_list) // max_workers))
+
+            scan_pool, own_pool = shared_pool()
+            try:
+                in_flight = deque()     # bounded, and collected in submission order to keep the result deterministic
+                for i in range(0, len(candidate_list), batch_size):
+                    in_flight.append( scan_pool.submit(matching_objects, candidate_list[i:i+batch_size]) )
+                    if len(in_flight) >= 2*max_workers:
+                        yield from in_flight.popleft().result()
+                while in_flight:
+                    yield from in_flight.popleft().result()
+
+                for subcollection_object in subcollection_objects:
+                    yield from subcollection_object.call('byquery', subcollection_params(scan_pool, stream=True))
+            finally:
+                if own_pool:
+                    scan_pool.shutdown()
+        else:
+            for relative_path in candidate_paths:
+                yield from matching_objects( [relative_path] )
+
+            for subcollection_object in subcollection_objects:
+                yield from subcollection_object.call('byquery', { 'query': compiled_query, 'max_workers': max_workers, 'stream': True })
+
+    if stream:
+        return generate_objects_found()
+    else:
+        return list( generate_objects_found() )
+
+
+## In-memory copies of persisted name indices, keyed by the real path of their root collection:
+#
+_name_indices           = {}
+_roots_being_indexed    = set()
+
+
+def _json_stamp(stamp):
+    "Make the kernel's file stamp comparable with its JSON-loaded copy"
+
+    return [ list(file_stamp) if file_stamp else None for file_stamp in stamp ]
+
+
+def _collection_stamp(collection_real_path, __kernel__):
+    "The collection's own files' stamp, including its database if it keeps the entries in one"
+
+    import os
+    import utils
+
+    return _json_stamp( __kernel__.entry_stamp(collection_real_path) + (utils.file_stamp( os.path.join(collection_real_path, '.entries.sqlite') ),) )
+
+
+def _load_name_index(__entry__, __kernel__):
+    """ Get the flattened name index of the collection graph rooted in this collection
+        (from memory, from its sidecar file or by (re)building it) and make sure it is still valid.
+    """
+    import os
+    import json
+
+    root_real_path  = os.path.realpath( __entry__.get_path() )
+    index_file_path = __entry__.get_path('.name_index.json')
+
+    index = _name_indices.get(root_real_path)
+    if index==None and os.path.isfile(index_file_path):
+        with open(index_file_path) as index_file:
+            index = json.load(index_file)
+
+    if index:
+        for collection_real_path, collection_record in index['collections'].items():
+            if _collection_stamp(collection_real_path, __kernel__) != collection_record['stamp']:
+                print("COLLECTION.name_index() {} has changed, rebuilding ...".format(collection_real_path))
+                index = _build_name_index(__entry__, __kernel__, index['collections'])
+                break
+    else:
+        index = _build_name_index(__entry__, __kernel__, {})
+
+    _name_indices[root_real_path] = index
+    return index
+
+
+def _build_name_index(__entry__, __kernel__, old_collections):
+    """ Walk the collection graph in byname() order (own names first, then collections_searchpath depth-first)
+        and flatten it into a single name -> [collection_path, relative_path] map.
+        Collections whose parameters have not changed since the previous build are not reloaded.
+    """
+    import os
+    import utils
+
+    root_real_path  = os.path.realpath( __entry__.get_path() )
+    collections     = {}
+    flat_map        = {}
+
+    _roots_being_indexed.add( root_real_path )
+    try:
+        pending = [ __entry__.get_path() ]
+        while pending:
+            collection_path         = pending.pop(0)
+            collection_real_path    = os.path.realpath( collection_path )
+            if collection_real_path in collections:     # protection against cyclic searchpaths
+                continue
+
+            stamp           = _collection_stamp(collection_real_path, __kernel__)
+            old_record      = old_collections.get(collection_real_path)
+            if old_record and old_record['stamp']==stamp:
+                collection_record = old_record
             else:
-                unary_op_match = re.match('([\w\.]*\w)(\.|\?)$', condition)
-                if unary_op_match:
-                    key_path    = unary_op_match.group(1).split('.')
-                    if unary_op_match.group(2)=='.':
-                        check_list.append( traverse_and_apply(key_path, lambda x, y: x!=None) )
-                    elif unary_op_match.group(2)=='?':
-                        check_list.append( traverse_and_apply(key_path, lambda x, y: bool(x)) )
-                else:
-                    tag_match = re.match('([!^-])?(\w+)$', condition)
-                    if tag_match:
-                        if tag_match.group(1):
-                            negative_tags_set.add( tag_match.group(2) )
-                        else:
-                            positive_tags_set.add( tag_match.group(2) )
+                collection_object   = __kernel__.bypath(collection_path)
+                name_2_path         = _collection_name_2_path(collection_object)
+                searchpath          = []
+                for subcollection_name in collection_object['collections_searchpath'] or []:
+                    if subcollection_name.find('/')>=0:
+                        searchpath.append( subcollection_name )
+                    elif subcollection_name in name_2_path:
+                        searchpath.append( collection_object.get_path(name_2_path[subcollection_name]) )
                     else:
-                        raise(SyntaxError("Could not parse the condition '{}'".format(condition)))
+                        subcollection_object = __kernel__.byname(subcollection_name)
+                        if subcollection_object:
+                            searchpath.append( subcollection_object.get_path() )
 
-    objects_found = []
+                collection_record = {
+                    'path':         collection_path,
+                    'stamp':        stamp,
+                    'name_2_path':  name_2_path,
+                    'searchpath':   searchpath,
+                }
 
-    # Applying the query:
-    #
-    for relative_path in name_2_path.values():
-        full_path = __entry__.get_path(relative_path)
-        candidate_object    = __kernel__.bypath(full_path)
-        candidate_tags_set  = set(candidate_object['tags'] or [])
-        if (positive_tags_set <= candidate_tags_set) and negative_tags_set.isdisjoint(candidate_tags_set):
-            candidate_still_ok = True
-            for check in check_list:
-                if not check(candidate_object):
-                    candidate_still_ok = False
-                    break
-            if candidate_still_ok:
-                objects_found.append( candidate_object )
+            collections[collection_real_path] = collection_record
+            for entry_name, relative_path in collection_record['name_2_path'].items():
+                flat_map.setdefault( entry_name, [collection_record['path'], relative_path] )
 
-    # Recursion into collections:
-    #
-    if collections_searchpath:
-        for subcollection_name in collections_searchpath:
-            if subcollection_name.find('/')>=0:
-                subcollection_object    = __kernel__.bypath(subcollection_name)
-            else:
-                subcollection_local     = name_2_path.get(subcollection_name)
-                subcollection_object    = __kernel__.byname(subcollection_name, __entry__ if subcollection_local else None)
+            pending = collection_record['searchpath'] + pending     # depth-first, same order as the recursive search
+    finally:
+        _roots_being_indexed.discard( root_real_path )
+
+    index = {
+        'collections':  collections,
+        'flat_map':     flat_map,
+    }
 
-            objects_found_in_subcollection  = subcollection_object.call('byquery', { 'query': parsed_query })
-            objects_found.extend( objects_found_in_subcollection )
+    utils.store_structure_to_json_file(index, __entry__.get_path('.name_index.json'), json_indent=None)    # other threads may be reading it
 
-    return objects_found
+    return index
+
+
+def name_index(__entry__=None, __kernel__=None):
+    """ Show the flattened name index of all the collections reachable from this one.
+
+        Usage example:
+            clip name_index
+    """
+
+    return _load_name_index(__entry__, __kernel__)['flat_map']
 
 
 def byname(entry_name, name_2_path, collections_searchpath, __entry__=None, __kernel__=None):
-    """ Find a relative path of the named entry in this collection entry's index.
+    """ Find the named entry in this collection entry's index or in the collections it refers to.
+        The whole collection graph is looked up in one go via the flattened name index.
+    """
+    import os
+
+    if os.path.realpath( __entry__.get_path() ) in _roots_being_indexed:
+        return byname_recursively(entry_name, name_2_path, collections_searchpath, __entry__, __kernel__)
+
+    found_pair = _load_name_index(__entry__, __kernel__)['flat_map'].get(entry_name)
+    if found_pair:
+        collection_path, relative_path = found_pair
+        collection_object = __kernel__.bypath( collection_path )
+        return _collection_member(collection_object, __kernel__, relative_path, _parameters_store(collection_object))
+    else:
+        return None
+
+
+def byname_recursively(entry_name, name_2_path, collections_searchpath, __entry__=None, __kernel__=None):
+    """ Find the named entry by walking this collection entry's index and recursing into collections_searchpath.
     """
 
-    relative_path   = name_2_path.get(entry_name)
+    store           = _parameters_store(__entry__)
+    relative_path   = store.lookup(entry_name) if store else name_2_path.get(entry_name)
     if relative_path:
-        return __kernel__.bypath( __entry__.get_path(relative_path) )
+        return _collection_member(__entry__, __kernel__, relative_path, store)
 
     # Recursion into collections:
     #
@@ -185,10 +894,10 @@ def byname(entry_name, name_2_path, collections_searchpath, __entry__=None, __ke
             if subcollection_name.find('/')>=0:
                 subcollection_object    = __kernel__.bypath(subcollection_name)
             else:
-                subcollection_local     = name_2_path.get(subcollection_name)
+                subcollection_local     = store.lookup(subcollection_name) if store else name_2_path.get(subcollection_name)
                 subcollection_object    = __kernel__.byname(subcollection_name, __entry__ if subcollection_local else None)
 
-            found_object            = __kernel__.byname(entry_name, subcollection_object)
+            found_object            = subcollection_object.call('byname_recursively', { 'entry_name': entry_name })
             if found_object:
                 return found_object
     
@@ -200,25 +909,72 @@ def add_entry(entry_name, data=None, __entry__=None, __kernel__=None):
         Usage example:
             clip byname --entry_name=words_collection add_entry --entry_name=xyz --data.foo.bar=1234 --data.baz=alpha
     """
+
+    return add_entries({ entry_name: data }, __entry__=__entry__, __kernel__=__kernel__)[0]
+
+
+def add_entries(entries, __entry__=None, __kernel__=None):
+    """ Add many entries at once: a dictionary of entry_name -> data (or a list of entry names).
+        The new entries are created first, then the collection's parameters and its tag index are committed once,
+        so a large batch costs one rewrite of the collection instead of one per entry.
+        Nothing is changed if any of the names is taken, and a failure half way removes the directories created so far.
+
+        Usage example:
+            clip byname --entry_name=words_collection , add_entries --entries.xyz.foo=1234 --entries.abc.baz=alpha
+    """
     import os
+    import shutil
+    import utils
 
-    # Create the physical directory for the new entry:
-    new_entry_full_path = __entry__.get_path(entry_name)
-    print("add_entry: new_entry_full_path="+new_entry_full_path)
-    os.makedirs(new_entry_full_path)      # FIXME: fail gracefully if directory path existed
+    if type(entries)!=dict:
+        entries = { entry_name: None for entry_name in entries }
 
-    # Add the new entry to collection:
-    __entry__.parameters_loaded()['name_2_path'][entry_name] = entry_name
-    __entry__.update()
+    store = _parameters_store(__entry__)
+    name_2_path = None if store else __entry__.parameters_loaded()['name_2_path']
+    taken_names = [ entry_name for entry_name in entries
+                    if (store.lookup(entry_name)!=None if store else entry_name in name_2_path) or os.path.exists(__entry__.get_path(entry_name)) ]
+    if taken_names:
+        raise FileExistsError( "the entries already exist in the collection: {}".format(taken_names) )
 
-    if data==None:
-        data = {}
+    if store:                   # one transaction, no files at all
+        store.add_entries( [ (entry_name, entry_name, data or {}) for entry_name, data in entries.items() ] )
+        return [ _collection_member(__entry__, __kernel__, entry_name, store) for entry_name in entries ]
 
-    # Update parameters of the new entry:
-    new_entry = __kernel__.bypath(new_entry_full_path)
-    new_entry.update( data )
+    tag_index = _load_tag_index(__entry__, __kernel__, revalidate=False)
+    parameters_rel_path, _ = __kernel__.parameters_location
 
-    return new_entry
+    new_entries     = []
+    created_names   = []    # the directories that are ours to remove if anything fails
+    try:
+        # Create the physical directories and parameters of the new entries:
+        for entry_name, data in entries.items():
+            new_entry_full_path = __entry__.get_path(entry_name)
+            print("add_entry: new_entry_full_path="+new_entry_full_path)
+            os.makedirs(new_entry_full_path)
+            created_names.append( entry_name )
+            utils.store_structure_to_json_file(data or {}, os.path.join(new_entry_full_path, parameters_rel_path))
+
+            new_entry = __kernel__.bypath(new_entry_full_path)
+            new_entry.collection_entry = __entry__
+            new_entries.append( new_entry )
+
+        # Add the new entries to collection in one go:
+        for entry_name in entries:
+            name_2_path[entry_name] = entry_name
+        __entry__.update()
+    except BaseException:
+        for entry_name in entries:
+            name_2_path.pop(entry_name, None)
+        for entry_name in created_names:
+            print("add_entry: rolling back new_entry_full_path="+__entry__.get_path(entry_name))
+            shutil.rmtree( __entry__.get_path(entry_name), ignore_errors=True )
+        raise
+
+    for entry_name in entries:
+        _tag_index_entry(tag_index, entry_name, *_own_parameters_with_stamp(__entry__, __kernel__, entry_name))
+    _store_tag_index(__entry__, __kernel__, tag_index)
+
+    return new_entries
 
 
 def delete_entry(entry_name, __entry__=None, __kernel__=None):
@@ -226,22 +982,223 @@ def delete_entry(entry_name, __entry__=None, __kernel__=None):
         Usage example:
             clip byname --entry_name=words_collection delete_entry --entry_name=xyz
     """
+
+    return delete_entries([ entry_name ], __entry__=__entry__, __kernel__=__kernel__)
+
+
+def delete_entries(entry_names, __entry__=None, __kernel__=None):
+    """ Delete many entries at once: the collection's parameters and its tag index are committed once,
+        and only then the physical directories of the old entries are removed.
+        Repeated names count once, and nothing is changed if any of the names is missing.
+
+        Usage example:
+            clip byname --entry_name=words_collection , delete_entries --entry_names,=xyz,abc
+    """
+    import os
     import shutil
 
+    entry_names = list( dict.fromkeys(entry_names) )   # without repetitions, in the original order
+
+    store = _parameters_store(__entry__)
+    if store:                   # one transaction, then the directories of the entries that had any files
+        for relative_path in store.delete_entries(entry_names):
+            if os.path.isdir( __entry__.get_path(relative_path) ):
+                print("delete_entry: old_entry_full_path="+__entry__.get_path(relative_path))
+                shutil.rmtree( __entry__.get_path(relative_path) )
+        return __entry__
+
     name_2_path = __entry__.parameters_loaded()['name_2_path']
-    old_entry_full_path = __entry__.get_path(name_2_path[entry_name])
-    print("delete_entry: old_entry_full_path="+old_entry_full_path)
+    missing_names = [ entry_name for entry_name in entry_names if entry_name not in name_2_path ]
+    if missing_names:           # fail before changing anything
+        raise KeyError( "no such entries in the collection: {}".format(missing_names) )
+    old_entry_full_paths = [ __entry__.get_path(name_2_path[entry_name]) for entry_name in entry_names ]
 
-    # Remove the old entry from collection:
-    del name_2_path[entry_name]
+    # Remove the old entries from collection:
+    tag_index = _load_tag_index(__entry__, __kernel__, revalidate=False)
+    relative_paths = [ name_2_path.pop(entry_name) for entry_name in entry_names ]
     __entry__.update()
+    remaining_relative_paths = set(name_2_path.values())
+    for relative_path in relative_paths:
+        if relative_path not in remaining_relative_paths:
+            _tag_index_set(tag_index, relative_path, None)
+    _store_tag_index(__entry__, __kernel__, tag_index)
 
-    # Remove the physical directory of the old entry:
-    shutil.rmtree(old_entry_full_path)
+    # Remove the physical directories of the old entries:
+    for old_entry_full_path in old_entry_full_paths:
+        print("delete_entry: old_entry_full_path="+old_entry_full_path)
+        shutil.rmtree(old_entry_full_path)
 
     return __entry__
 
 
+def export_collection(target_path, files=None, __entry__=None, __kernel__=None):
+    """ Stream the collection's entries into a JSON Lines file (gzip-compressed if the name ends with .gz), one entry per line:
+            {"entry_name": ..., "relative_path": ..., "parameters": {...}, "files": [{"path": ..., "size": ..., "sha256": ...}, ...]}
+        Only the entries' own parameters are exported. The other files of the entries are left out by default,
+        listed with files=manifest, or carried along (base64-encoded) with files=contents.
+        The entries are read straight from disk one by one, so the memory use does not grow with the collection.
+        Returns the number of entries exported.
+
+        Usage example:
+            clip byname --entry_name=words_collection , export_collection --target_path=words.jsonl.gz --files=contents
+    """
+    import os
+    import json
+    import gzip
+    import base64
+    import hashlib
+    import utils
+
+    parameters_rel_path, _ = __kernel__.parameters_location
+    open_function = gzip.open if target_path.endswith('.gz') else open
+    store = _parameters_store(__entry__)
+
+    entries_exported = 0
+    with open_function(target_path, 'wt') as target_file:
+        for entry_name, relative_path in _collection_name_2_path(__entry__).items():
+            entry_full_path = __entry__.get_path(relative_path)
+            if store:
+                parameters  = store.load_parameters( _collection_member(__entry__, __kernel__, relative_path, store) )
+            else:
+                parameters, _ = utils.quietly_load_json_config( os.path.join(entry_full_path, parameters_rel_path) )
+            record          = { 'entry_name': entry_name, 'relative_path': relative_path, 'parameters': parameters }
+
+            if files:
+                record['files'] = []
+                for dir_name, subdir_names, file_names in os.walk(entry_full_path):
+                    subdir_names[:] = [ subdir_name for subdir_name in subdir_names if subdir_name!='__pycache__' ]
+                    for file_name in sorted(file_names):
+                        file_path           = os.path.join(dir_name, file_name)
+                        file_relative_path  = os.path.relpath(file_path, entry_full_path)
+                        if file_relative_path==parameters_rel_path:
+                            continue
+                        with open(file_path, 'rb') as entry_file:
+                            file_bytes = entry_file.read()
+                        file_record = { 'path': file_relative_path, 'size': len(file_bytes), 'sha256': hashlib.sha256(file_bytes).hexdigest() }
+                        if files=='contents':
+                            file_record['content_base64'] = base64.b64encode(file_bytes).decode('ascii')
+                        record['files'].append( file_record )
+
+            target_file.write( json.dumps(record)+'\n' )
+            entries_exported += 1
+
+    return entries_exported
+
+
+def import_collection(source_path, max_workers=8, overwrite=False, __entry__=None, __kernel__=None):
+    """ Create the entries streamed from a JSON Lines file produced by export_collection (gzip-compressed if the name ends with .gz).
+        The entries are written by a pool of max_workers threads, with only a bounded number of them in flight,
+        while the collection's name_2_path and tag index are updated once at the end.
+        Entries whose names are already taken are skipped, unless overwrite is set. Returns the number of entries imported.
+        If an entry cannot be written, the import stops there: the entries written so far are still registered, then the error is raised.
+
+        Usage example:
+            clip byname --entry_name=words_collection , import_collection --source_path=words.jsonl.gz
+    """
+    import os
+    import json
+    import gzip
+    import base64
+    import hashlib
+    import utils
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    parameters_rel_path, _ = __kernel__.parameters_location
+    open_function   = gzip.open if source_path.endswith('.gz') else open
+    store           = _parameters_store(__entry__)
+    if store:       # the parameters go into the database in transactions of a bounded size, instead of a final commit
+        name_taken  = lambda entry_name: store.lookup(entry_name)!=None
+    else:
+        name_2_path = __entry__.parameters_loaded()['name_2_path']
+        name_taken  = lambda entry_name: entry_name in name_2_path
+        tag_index   = _load_tag_index(__entry__, __kernel__, revalidate=False)
+
+    def write_entry(record):
+        relative_path = os.path.normpath(record['relative_path'])
+        if os.path.isabs(relative_path) or relative_path.split(os.sep)[0]=='..' or relative_path=='.':
+            raise ValueError( "the entry '{}' would be outside of the collection: {}".format(record['entry_name'], record['relative_path']) )
+
+        entry_full_path = __entry__.get_path(relative_path)
+        for file_record in record.get('files', []):
+            file_path = os.path.normpath( os.path.join(entry_full_path, file_record['path']) )
+            if not file_path.startswith(entry_full_path+os.sep):
+                raise ValueError( "the file '{}' would be outside of the entry '{}'".format(file_record['path'], record['entry_name']) )
+            if 'content_base64' in file_record:
+                file_bytes = base64.b64decode(file_record['content_base64'])
+                if hashlib.sha256(file_bytes).hexdigest()!=file_record['sha256']:
+                    raise ValueError( "the file '{}' of the entry '{}' is damaged".format(file_record['path'], record['entry_name']) )
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, 'wb') as entry_file:
+                    entry_file.write(file_bytes)
+
+        if store:
+            return record['entry_name'], relative_path, record['parameters']
+
+        utils.store_structure_to_json_file(record['parameters'], os.path.join(entry_full_path, parameters_rel_path))
+
+        return record['entry_name'], relative_path, record['parameters'], _parameters_file_stamp(__entry__, __kernel__, relative_path)[1]
+
+    imported_entries    = []    # just the (entry_name, relative_path) pairs, the parameters are only kept until indexed
+    records_to_store    = []
+    entries_stored      = 0
+    first_error         = None
+    def collect(done_futures, final=False):
+        nonlocal entries_stored, first_error
+
+        for done_future in done_futures:
+            try:
+                if store:
+                    records_to_store.append( done_future.result() )
+                else:
+                    entry_name, relative_path, own_parameters, stamp = done_future.result()
+                    _tag_index_entry(tag_index, relative_path, own_parameters, stamp)
+                    imported_entries.append( (entry_name, relative_path) )
+            except Exception as e:
+                first_error = first_error or e
+        done_futures.clear()
+
+        if store and records_to_store and (final or len(records_to_store)>=1000):
+            store.add_entries(records_to_store)
+            entries_stored += len(records_to_store)
+            records_to_store.clear()
+
+    with open_function(source_path, 'rt') as source_file, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending_futures = deque()  # bounded, and collected in submission order to keep the order of the entries
+        try:
+            for line in source_file:
+                if first_error:
+                    break
+                record = json.loads(line)
+                if name_taken(record['entry_name']) and not overwrite:
+                    print("import_collection: skipping the existing entry '{}'".format(record['entry_name']))
+                    continue
+
+                pending_futures.append( pool.submit(write_entry, record) )
+                if len(pending_futures) >= 4*max_workers:
+                    collect( [ pending_futures.popleft() ] )
+        except Exception as e:      # a damaged source: the entries written so far still get registered
+            first_error = e
+
+        collect( pending_futures, final=True )
+
+    if store:
+        if first_error:
+            raise first_error
+        return entries_stored
+
+    # Add the new entries to collection in one go (they are already in the tag index):
+    for entry_name, relative_path in imported_entries:
+        name_2_path[entry_name] = relative_path
+    __entry__.update()
+
+    _store_tag_index(__entry__, __kernel__, tag_index)
+
+    if first_error:
+        raise first_error
+    return len(imported_entries)
+
+
 if __name__ == '__main__':
 
     # When the entry's code is run as a script, perform local tests:
@@ -249,5 +1206,78 @@ if __name__ == '__main__':
 
     show_map({"alpha" : 10, "beta" : 200})
 
+    ## Bulk ingestion benchmark: one entry at a time vs a batch, in a scratch collection
+    #
+    import os
+    import sys
+    import time
+    import tempfile
+    from os.path import dirname as dn
+    sys.path.append( dn(dn(__file__)) )
+    import utils
+    from class_entry import default_kernel_instance as kernel
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for entries_number in (500, 5000):
+            for mode in ('add_entry', 'add_entries'):
+                collection_path = '{}/{}_{}'.format(scratch_dir, mode, entries_number)
+                utils.store_structure_to_json_file({ 'parent_entry_name': 'core_collection', 'name_2_path': {} }, collection_path+'/parameters.json')
+                scratch_collection = kernel.bypath(collection_path)
+                entries = { 'entry_{}'.format(i): { 'tags': ['scratch', 'even' if i%2==0 else 'odd'], 'number': i } for i in range(entries_number) }
+
+                start_time = time.time()
+                if mode=='add_entries':
+                    scratch_collection.call('add_entries', { 'entries': entries })
+                elif entries_number<=500:
+                    for entry_name, data in entries.items():
+                        scratch_collection.call('add_entry', { 'entry_name': entry_name, 'data': data })
+                else:
+                    continue
+                print("BENCHMARK: {} entries via {}: {:.2f}s".format(entries_number, mode, time.time()-start_time), file=sys.stderr)
+
+        ## Replicating the largest scratch collection through a JSON Lines stream:
+        #
+        source_collection = kernel.bypath('{}/add_entries_5000'.format(scratch_dir))
+        source_collection.call('add_entry', { 'entry_name': 'with_a_file', 'data': { 'tags': ['scratch', 'with_a_file'] } })
+        with open(source_collection.get_path('with_a_file/notes.txt'), 'w') as notes_file:
+            notes_file.write("Files travel too\n")
+
+        start_time = time.time()
+        entries_exported = source_collection.call('export_collection', { 'target_path': scratch_dir+'/export.jsonl.gz', 'files': 'contents' })
+        print("BENCHMARK: {} entries exported: {:.2f}s".format(entries_exported, time.time()-start_time), file=sys.stderr)
+
+        utils.store_structure_to_json_file({ 'parent_entry_name': 'core_collection', 'name_2_path': {} }, scratch_dir+'/replica/parameters.json')
+        replica_collection = kernel.bypath(scratch_dir+'/replica')
+        start_time = time.time()
+        entries_imported = replica_collection.call('import_collection', { 'source_path': scratch_dir+'/export.jsonl.gz' })
+        print("BENCHMARK: {} entries imported: {:.2f}s".format(entries_imported, time.time()-start_time), file=sys.stderr)
+
+        print("Replica has the same entries: {}, the same tags: {}, the same files: {}".format(
+            replica_collection['name_2_path']==source_collection['name_2_path'],
+            replica_collection.call('tag_index')==source_collection.call('tag_index'),
+            open(replica_collection.get_path('with_a_file/notes.txt')).read()=="Files travel too\n",
+        ), file=sys.stderr)
+
+        ## The same entries in an SQLite-backed collection, where byquery runs as (mostly indexed) SQL:
+        #
+        utils.store_structure_to_json_file({ 'parent_entry_name': 'core_collection', 'storage': 'sqlite', 'indexed_parameters': ['number'] }, scratch_dir+'/sqlite_replica/parameters.json')
+        sqlite_collection = kernel.bypath(scratch_dir+'/sqlite_replica')
+        start_time = time.time()
+        entries_imported = sqlite_collection.call('import_collection', { 'source_path': scratch_dir+'/export.jsonl.gz' })
+        print("BENCHMARK: {} entries imported into SQLite: {:.2f}s".format(entries_imported, time.time()-start_time), file=sys.stderr)
+
+        for query in ('odd,number<100', 'number>=4990,-odd', 'with_a_file', 'scratch,number.'):
+            for collection_object in (replica_collection, sqlite_collection):
+                start_time = time.time()
+                objects_found = collection_object.call('byquery', { 'query': query })
+                query_time = time.time()-start_time
+                print("BENCHMARK: byquery {} in {}: {} found in {:.3f}s".format(query, collection_object.get_name(), len(objects_found), query_time), file=sys.stderr)
+            print("The same entries found: {}".format( [ o.get_name() for o in collection_object.call('byquery', { 'query': query }) ]==[ o.get_name() for o in replica_collection.call('byquery', { 'query': query }) ] ), file=sys.stderr)
+
+        updated_entry = sqlite_collection.call('byname', { 'entry_name': 'entry_7' })
+        updated_entry.update({ 'tags': ['scratch', 'odd', 'updated'] })
+        print("Updated in place: {}, files written: {}".format( [ o['number'] for o in sqlite_collection.call('byquery', { 'query': 'updated' }) ],
+                                                               sorted(os.listdir(scratch_dir+'/sqlite_replica')) ), file=sys.stderr)
+
     returned_path = byname('second', { "first" : "relative/path/to/the/first", "second" : "relative/path/to/the/second" })
     print("returned_path = {}\n".format(returned_path))
@@ -1,22 +1,217 @@
 #!/usr/bin/env python3
 
+""" Running shell commands: one at a time, many in parallel, or as memoized build steps.
 
+    A build step can be kept as an entry that inherits from this one:
+        clip add_entry --entry_name=wordcount_step --data.parent_entry_name=system_cmd --data.shell_cmd='wc -w words.txt > count.txt' --data.inputs,=words.txt --data.outputs,=count.txt
+
+    and re-running it does nothing (except for restoring the outputs, if they are missing or damaged) until its inputs change:
+        clip byname --entry_name=wordcount_step , run_cached
+"""
+
+import os
 import subprocess
 
 
-def run(shell_cmd='env', env=None):
+def job_environment(env=None):
+    "The current environment with the given variables added on top (values get stringified)"
+
+    if not env:
+        return None     # subprocess will simply inherit ours
+
+    return dict(os.environ, **{ k: str(v) for k, v in env.items() })
 
-    env = env or {}
 
-    env_setting_prefix = 'env ' + ' '.join([ '{}={}'.format(k,env.get(k,'')) for k in env])
-    if env_setting_prefix:
-        shell_cmd = env_setting_prefix + ' ' + shell_cmd
+def run(shell_cmd='env', env=None, cwd=None, timeout=None):
+    """
+        Usage example:
+            clip bypath --path=core_collection/system_cmd , run --shell_cmd='echo $FOO' --env.FOO=bar
+    """
 
-    return_code = subprocess.call(shell_cmd, shell = True)
+    return_code = subprocess.call(shell_cmd, shell=True, env=job_environment(env), cwd=cwd, timeout=timeout)
 
     return return_code
 
 
+async def arun(shell_cmd='env', env=None):
+    """ The asynchronous version of run(): the event loop is free to run other commands while this one is running.
+
+        Usage example:
+            clip bypath --path=core_collection/system_cmd , arun --shell_cmd='sleep 1; echo Done'
+    """
+    import asyncio
+
+    process = await asyncio.create_subprocess_shell(shell_cmd, env=job_environment(env))
+
+    return await process.wait()
+
+
+def run_job(shell_cmd='env', env=None, cwd=None, timeout=None, capture=True, stream=False, job_label=None):
+    """ Run one command and return a structured result: its exit code, duration and (unless capture is off) output.
+
+        With stream the output lines are also printed as they come, prefixed with the job_label,
+        and stderr is merged into stdout. On timeout the whole process group of the command is killed.
+
+        Usage example:
+            clip bypath --path=core_collection/system_cmd , run_job --shell_cmd='echo $FOO; sleep 1' --env.FOO=bar --timeout=5
+    """
+    import time
+    import signal
+
+    start_time  = time.time()
+    pipe        = subprocess.PIPE if (capture or stream) else None
+    process     = subprocess.Popen(shell_cmd, shell=True, env=job_environment(env), cwd=cwd, universal_newlines=True,
+                                   stdout=pipe, stderr=(subprocess.STDOUT if stream else pipe),
+                                   start_new_session=True)     # its own process group, so that a timeout kills the children too
+    timed_out   = False
+
+    try:
+        if stream:
+            from threading import Timer
+
+            stdout_lines    = []
+            killer          = Timer(timeout, os.killpg, (process.pid, signal.SIGKILL)) if timeout else None
+            if killer:
+                killer.start()
+            for line in process.stdout:
+                print('[{}] {}'.format(process.pid if job_label==None else job_label, line), end='', flush=True)
+                stdout_lines.append(line)
+            process.wait()
+            if killer:
+                timed_out = not killer.is_alive()
+                killer.cancel()
+            stdout, stderr = ''.join(stdout_lines), None
+        else:
+            stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        stdout, stderr  = process.communicate()
+        timed_out       = True
+
+    return {
+        'shell_cmd':    shell_cmd,
+        'return_code':  process.returncode,
+        'timed_out':    timed_out,
+        'duration':     time.time() - start_time,
+        'stdout':       stdout if capture else None,
+        'stderr':       stderr if capture else None,
+    }
+
+
+def run_jobs(jobs, max_workers=8, env=None, cwd=None, timeout=None, capture=True, stream=False):
+    """ Run many commands on a bounded pool of workers and return their structured results (see run_job) in the original order.
+
+        A job is either a shell command or a dictionary with shell_cmd and optionally its own env, cwd and timeout,
+        which take precedence over the common ones (the job's env is added on top of the common env).
+
+        Usage example:
+            clip bypath --path=core_collection/system_cmd , run_jobs --jobs,='sleep 1; echo one','sleep 1; echo two' --max_workers=2 --stream
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run_one(job_idx, job):
+        if type(job)!=dict:
+            job = { 'shell_cmd': job }
+
+        return run_job( job['shell_cmd'], dict(env or {}, **job.get('env', {})), job.get('cwd', cwd), job.get('timeout', timeout),
+                        capture, stream, job.get('label', job_idx) )
+
+    # the workers only wait for their subprocesses, so threads are enough:
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list( pool.map(run_one, range(len(jobs)), jobs) )
+
+
+def content_hash(file_path, chunk_size=1024*1024):
+    "The sha256 of the file's contents"
+
+    import hashlib
+
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def atomic_copy(source_path, target_path):
+    "Copy the file so that the target only appears once it is complete"
+
+    import shutil
+
+    os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+    temp_path = '{}.{}.tmp'.format(target_path, os.getpid())
+    shutil.copyfile(source_path, temp_path)
+    os.replace(temp_path, target_path)
+
+
+def run_cached(shell_cmd, inputs=None, outputs=None, env=None, cwd=None, timeout=None, artifact_cache_dir=None, __kernel__=None):
+    """ Run the command unless a previous successful run had the same command line, env and input file contents,
+        in which case only make sure the outputs are in place: the intact ones are kept, the missing or damaged ones
+        get restored from the artifact cache. The input and output paths are relative to cwd (the current directory by default).
+
+        The artifact cache (kernel's result cache neighbour by default) keeps a manifest per run key
+        and the output files themselves under their content hashes.
+
+        Usage example:
+            clip bypath --path=core_collection/system_cmd , run_cached --shell_cmd='sort words.txt > sorted.txt' --inputs,=words.txt --outputs,=sorted.txt
+    """
+    import json
+    import hashlib
+
+    inputs              = inputs or []
+    outputs             = outputs or []
+    cwd                 = os.path.abspath(cwd or os.getcwd())
+    artifact_cache_dir  = artifact_cache_dir or os.path.join(os.path.dirname(__kernel__.result_cache_dir), 'artifacts')
+
+    run_key = hashlib.sha256( json.dumps( [ shell_cmd, { k: str(v) for k, v in (env or {}).items() }, cwd,
+                                            [ [input_path, content_hash(os.path.join(cwd, input_path))] for input_path in inputs ],
+                                            sorted(outputs) ], sort_keys=True ).encode('utf-8') ).hexdigest()
+
+    manifest_path   = os.path.join(artifact_cache_dir, 'runs', run_key[:2], run_key+'.json')
+    blob_path       = lambda output_hash: os.path.join(artifact_cache_dir, 'blobs', output_hash[:2], output_hash)
+
+    ## Up to date, or at least restorable:
+    #
+    try:
+        with open(manifest_path) as manifest_file:
+            output_hashes = json.load(manifest_file)['outputs']
+
+        outputs_restored = []
+        for output_path, output_hash in output_hashes.items():
+            full_output_path = os.path.join(cwd, output_path)
+            if not (os.path.isfile(full_output_path) and content_hash(full_output_path)==output_hash):
+                atomic_copy(blob_path(output_hash), full_output_path)
+                outputs_restored.append( output_path )
+
+        print("SYSTEM_CMD.run_cached() up to date: {}{}".format(shell_cmd, ', restored: {}'.format(outputs_restored) if outputs_restored else ''))
+        return { 'shell_cmd': shell_cmd, 'return_code': 0, 'cached': True, 'outputs_restored': outputs_restored }
+    except (OSError, ValueError, KeyError):     # never ran, or the cache has been (partially) cleaned up
+        pass
+
+    result = run_job(shell_cmd, env, cwd, timeout, capture=False)
+    result['cached'] = False
+
+    ## Only the successful runs that produced all their outputs are remembered:
+    #
+    if result['return_code']==0 and all( os.path.isfile(os.path.join(cwd, output_path)) for output_path in outputs ):
+        output_hashes = {}
+        for output_path in outputs:
+            full_output_path    = os.path.join(cwd, output_path)
+            output_hash         = content_hash(full_output_path)
+            if not os.path.exists(blob_path(output_hash)):
+                atomic_copy(full_output_path, blob_path(output_hash))
+            output_hashes[output_path] = output_hash
+
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+        with open(temp_path, 'w') as manifest_file:
+            json.dump( { 'shell_cmd': shell_cmd, 'outputs': output_hashes }, manifest_file )
+        os.replace(temp_path, manifest_path)
+
+    return result
+
+
 if __name__ == '__main__':
 
     # When the entry's code is run as a script, perform local tests:
@@ -24,5 +219,41 @@ if __name__ == '__main__':
     return_code = run( "echo Hello, world!" )
     print("ReturnCode = {}\n".format(return_code))
 
-    return_code = run( env={'FOO':12345, 'BAR':23456, 'BAZ':34567} )
+    import asyncio
+
+    async def run_all():
+        return await asyncio.gather( *[ arun( "sleep 1; echo Slept in parallel: $N", env={'N': n} ) for n in range(5) ] )
+
+    return_codes = asyncio.run( run_all() )
+    print("ReturnCodes = {}\n".format(return_codes))
+
+    return_code = run( "env | grep '^BA[RZ]='", env={'FOO':12345, 'BAR':23456, 'BAZ':34567} )
     print("ReturnCode = {}\n".format(return_code))
+
+    results = run_jobs( [ 'sleep 1; echo Job $N done', { 'shell_cmd': 'pwd; echo oops >&2; exit 3', 'cwd': '/tmp' }, { 'shell_cmd': 'sleep 10', 'timeout': 2 } ]
+                        + [ 'sleep 1' ]*20, env={'N': 0}, max_workers=24 )
+    for result in results[:3]:
+        print(result)
+    print("Exit codes = {}, the longest duration = {:.2f}s\n".format( [ result['return_code'] for result in results ], max( result['duration'] for result in results ) ))
+
+    results = run_jobs( [ 'for i in 1 2 3; do echo line $i; sleep 0.2; done' ]*3, stream=True, capture=False )
+    print("Streamed results = {}\n".format(results))
+
+    import tempfile
+    from types import SimpleNamespace
+
+    with tempfile.TemporaryDirectory() as work_dir, tempfile.TemporaryDirectory() as cache_dir:
+        with open(os.path.join(work_dir, 'words.txt'), 'w') as words_file:
+            words_file.write("delta\nalpha\ncharlie\nbravo\n")
+
+        step = lambda: run_cached( 'sleep 1; sort words.txt > sorted.txt', inputs=['words.txt'], outputs=['sorted.txt'], cwd=work_dir,
+                                   __kernel__=SimpleNamespace(result_cache_dir=os.path.join(cache_dir, 'results')) )
+
+        print("First run: {}".format(step()))
+        print("Nothing changed: {}".format(step()))
+        os.remove(os.path.join(work_dir, 'sorted.txt'))
+        print("Output removed: {}".format(step()))
+        with open(os.path.join(work_dir, 'words.txt'), 'a') as words_file:
+            words_file.write("echo\n")
+        print("Input changed: {}".format(step()))
+        print("Sorted: {}\n".format( open(os.path.join(work_dir, 'sorted.txt')).read().split() ))
@@ -7,9 +7,13 @@
 
 import os           # to manipulate file paths
 import sys          # to obtain Python's version
-import imp          # to import modules dynamically
-import json         # to load JSON-based config files
-import inspect      # to obtain a random function's signature
+import threading    # to serialize module loading
+import weakref      # to let the call adapters go together with their functions
+
+# To keep the cold start short, heavier modules are only imported where (and when) they are needed:
+#   importlib.util  to import modules dynamically
+#   json            to load JSON-based config files
+#   inspect         to obtain a random function's signature
 
 
 def merged_dictionaries(under_dict, over_dict):
@@ -21,13 +25,41 @@ def merged_dictionaries(under_dict, over_dict):
     return merged_dict
 
 
+_module_cache       = {}    # real path of the code container -> ((mtime, size), module_object)
+_module_cache_lock  = threading.Lock()
+
+
 def get_entrys_python_module(module_path, code_container_name='python_code'):
     """ Find and load a python module given the path and filename.
 
+        Each code container gets imported once per process (and once more only if it changes on disk),
+        no matter how many entries use it. Its bytecode is cached in __pycache__ by importlib.
     """
-    (open_file_descriptor, path_to_module, module_description) = imp.find_module(code_container_name, [module_path])
+    file_path = os.path.realpath( os.path.join(module_path, code_container_name+'.py') )
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        raise ImportError( "No module named '{}' in '{}'".format(code_container_name, module_path) )
+
+    stamp = (file_stat.st_mtime_ns, file_stat.st_size)
+
+    import importlib.util
+
+    with _module_cache_lock:
+        cached_pair = _module_cache.get(file_path)
+        if cached_pair and cached_pair[0]==stamp:
+            return cached_pair[1]
+
+        module_spec     = importlib.util.spec_from_file_location(file_path, file_path)     # the path is a unique module name
+        module_object   = importlib.util.module_from_spec(module_spec)
+        sys.modules[module_spec.name] = module_object       # so that its functions can be pickled by reference
+        try:
+            module_spec.loader.exec_module(module_object)
+        except:
+            del sys.modules[module_spec.name]
+            raise
 
-    module_object = imp.load_module(path_to_module, open_file_descriptor, path_to_module, module_description)
+        _module_cache[file_path] = (stamp, module_object)
 
     return module_object
 
@@ -35,6 +67,7 @@ def get_entrys_python_module(module_path, code_container_name='python_code'):
 def expected_call_structure(function_object, class_method=False):
     """ Get the expected parameters of a function and their default values.
     """
+    import inspect
 
     if sys.version_info[0] < 3:
         supported_arg_names, varargs, varkw, defaults = inspect.getargspec(function_object)
@@ -53,32 +86,139 @@ def expected_call_structure(function_object, class_method=False):
     return required_arg_names, optional_arg_names, defaults, varargs, varkw
 
 
+_call_adapters          = weakref.WeakKeyDictionary()     # function -> { class_method -> adapter } , dropped when the function is (e.g. on reload)
+_primed_call_adapters   = {}    # (code file path, function's qualname, its first line, class_method) -> adapter , from a warm-start snapshot
+
+
+def file_stamp(file_path):
+    "A cheap fingerprint of a file: its mtime and size (None if it does not exist)"
+
+    try:
+        file_stat = os.stat(file_path)
+        return (file_stat.st_mtime_ns, file_stat.st_size)
+    except OSError:
+        return None
+
+
+_file_hashes = {}   # file path -> (stamp, sha256 hex digest)
+
+
+def file_hash(file_path):
+    "A sha256 of the file's contents, only recomputed when the file changes"
+
+    import hashlib
+
+    stamp       = file_stamp(file_path)
+    cached_pair = _file_hashes.get(file_path)
+    if cached_pair and cached_pair[0]==stamp:
+        return cached_pair[1]
+
+    with open(file_path, 'rb') as fd:
+        digest = hashlib.sha256( fd.read() ).hexdigest()
+    _file_hashes[file_path] = (stamp, digest)
+
+    return digest
+
+
+def list_files_by_mtime(dir_path):
+    "All the files under the directory as (mtime, path, size) triplets, the oldest first"
+
+    files = []
+    for dir_name, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            file_path = os.path.join(dir_name, file_name)
+            try:
+                file_stat = os.stat(file_path)
+                files.append( (file_stat.st_mtime, file_path, file_stat.st_size) )
+            except OSError:
+                pass
+
+    return sorted(files)
+
+
+def export_call_adapters():
+    """ A catalog of all the call adapters built so far (for the functions defined in files),
+        grouped by the code file and stamped with its current state.
+        Within a file the functions are told apart by their qualname and first line.
+        The lambdas are left out, as several of them can share both.
+    """
+    catalog = {}
+    for function_object, adapters in list(_call_adapters.items()):
+        code_object = getattr(function_object, '__code__', None)
+        if code_object and code_object.co_name!='<lambda>':
+            file_path = code_object.co_filename
+            if file_path not in catalog:
+                catalog[file_path] = { 'stamp': file_stamp(file_path), 'adapters': {} }
+            for class_method, adapter in list(adapters.items()):
+                catalog[file_path]['adapters'][ (function_object.__qualname__, code_object.co_firstlineno, class_method) ] = adapter
+
+    return catalog
+
+
+def import_call_adapters(catalog):
+    "Prime call_adapter() with the adapters from the code files that have not changed since the catalog was exported"
+
+    for file_path, file_record in catalog.items():
+        if file_record['stamp'] and file_record['stamp']==file_stamp(file_path):
+            for adapter_key, adapter in file_record['adapters'].items():
+                if len(adapter_key)==3:     # the catalogs of older versions did not tell the lambdas apart
+                    qualname, first_line, class_method = adapter_key
+                    _primed_call_adapters[ (file_path, qualname, first_line, class_method) ] = adapter
+
+
+def call_adapter(function_object, class_method=False):
+    """ Analyze the function's signature once into a compact binding recipe and keep it for the later calls:
+        the required arg names (in order), the set of optional arg names and whether **kwargs are accepted.
+    """
+
+    function_key = getattr(function_object, '__func__', function_object)    # bound methods are re-created on every getattr()
+    try:
+        return _call_adapters[function_key][class_method]
+    except KeyError:
+        pass
+    except TypeError:       # callables that cannot be weakly referenced (e.g. built-ins) are not cached
+        function_key = None
+
+    code_object = getattr(function_key, '__code__', None)
+    adapter     = code_object and _primed_call_adapters.get( (code_object.co_filename, function_key.__qualname__, code_object.co_firstlineno, class_method) )
+    if not adapter:
+        required_arg_names, optional_arg_names, defaults, varargs, varkw = expected_call_structure(function_object, class_method)
+        adapter = ( tuple(required_arg_names), frozenset(optional_arg_names), bool(varkw) )
+
+    if function_key!=None:
+        _call_adapters.setdefault(function_key, {})[class_method] = adapter
+
+    return adapter
+
+
 def free_access(function_object, given_arg_list, given_arg_dict, class_method=False):
     """ Call a given function_object and feed it with arguments from given list and dictionary.
 
         The function can be declared as having named args, defaults and optionally **kwargs.
     """
 
-    required_arg_names, optional_arg_names, defaults, varargs, varkw = expected_call_structure(function_object, class_method)
+    required_arg_names, optional_arg_names_set, varkw = call_adapter(function_object, class_method)
 
     non_listed_required_arg_names = required_arg_names[len(given_arg_list):]
-    missing_args_set    = set(non_listed_required_arg_names) - set(given_arg_dict)
+    missing_arg_names   = [ k for k in non_listed_required_arg_names if k not in given_arg_dict ]
 
-    if missing_args_set:
+    if missing_arg_names:
         raise TypeError( 'The "{}" function IS NOT callable with {} and {}. Missing required positional supported_arg_names: {}'
-                        .format(function_object.__name__, given_arg_list, given_arg_dict, list(missing_args_set))
+                        .format(function_object.__name__, given_arg_list, given_arg_dict, missing_arg_names)
         )
     else:
         if varkw:   # only leave out the required parameters without defaults:
 
-            relevant_dict_names = set(given_arg_dict) - set(non_listed_required_arg_names)
+            if non_listed_required_arg_names:
+                args_passed_as_dict = { k : v for k, v in given_arg_dict.items() if k not in non_listed_required_arg_names }
+            else:
+                args_passed_as_dict = dict( given_arg_dict )
 
         else:       # only take relevant optional parameters and leave gaps for the signature's defaults to mix in:
 
-            relevant_dict_names = set(given_arg_dict) & set(optional_arg_names)
+            args_passed_as_dict = { k : given_arg_dict[k] for k in optional_arg_names_set if k in given_arg_dict }
 
-        arg_values_passed_as_list   = given_arg_list + [given_arg_dict[k] for k in non_listed_required_arg_names]
-        args_passed_as_dict         = { k : given_arg_dict[k] for k in relevant_dict_names }
+        arg_values_passed_as_list   = list(given_arg_list) + [given_arg_dict[k] for k in non_listed_required_arg_names]
 
         ret_values = function_object(*arg_values_passed_as_list, **args_passed_as_dict)
         return ret_values
@@ -87,6 +227,7 @@ def free_access(function_object, given_arg_list, given_arg_dict, class_method=Fa
 def quietly_load_json_config( filepath, structpath=[] ):
 
     if os.path.isfile( filepath ):
+        import json
         with open( filepath ) as fd:
             struct_ptr = json.load(fd)
             for syll in structpath:
@@ -101,8 +242,21 @@ def quietly_load_json_config( filepath, structpath=[] ):
 
 
 def store_structure_to_json_file( structure, filepath, json_indent=4 ):
-    with open(filepath, "w") as json_file:
-        json_file.write( json.dumps(structure, indent=json_indent)+'\n' )
+    "Atomically (re)place the file: it either keeps the old contents or gets the complete new ones, never a truncated mix"
+
+    import json
+
+    dir_path = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(dir_path, exist_ok=True)
+    temp_path = os.path.join(dir_path, '.{}.{}.{}.tmp'.format(os.path.basename(filepath), os.getpid(), threading.get_ident()))
+    try:
+        with open(temp_path, "w") as json_file:
+            json_file.write( json.dumps(structure, indent=json_indent)+'\n' )
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
 
 
 def baz(alpha, beta=22, gamma=333):
@@ -174,3 +328,47 @@ if __name__ == '__main__':
         print("hex = {}\n".format(h1))
         h2 = free_access( hex, [30], {})
         print("hex = {}\n".format(h2))
+
+    # micro-benchmark of the per-call overhead: free_access analyzing the signature on every call vs via the cached call adapter:
+    import timeit
+
+    def free_access_by_analysis(function_object, given_arg_list, given_arg_dict, class_method=False):
+        "The previous version of free_access(), which introspected the signature on every call"
+
+        required_arg_names, optional_arg_names, defaults, varargs, varkw = expected_call_structure(function_object, class_method)
+
+        non_listed_required_arg_names = required_arg_names[len(given_arg_list):]
+        missing_args_set    = set(non_listed_required_arg_names) - set(given_arg_dict)
+
+        if missing_args_set:
+            raise TypeError( 'Missing required positional supported_arg_names: {}'.format(list(missing_args_set)) )
+        elif varkw:
+            relevant_dict_names = set(given_arg_dict) - set(non_listed_required_arg_names)
+        else:
+            relevant_dict_names = set(given_arg_dict) & set(optional_arg_names)
+
+        arg_values_passed_as_list   = given_arg_list + [given_arg_dict[k] for k in non_listed_required_arg_names]
+        args_passed_as_dict         = { k : given_arg_dict[k] for k in relevant_dict_names }
+
+        return function_object(*arg_values_passed_as_list, **args_passed_as_dict)
+
+    def qux(alpha, beta, gamma=3, delta=4):
+        return alpha
+
+    qux_params  = { 'alpha' : 1, 'beta' : 2, 'delta' : 40, 'lambda' : 7777, 'mu' : 8888 }
+    n_calls     = 20000
+    t_analysis  = timeit.timeit( lambda: free_access_by_analysis(qux, [], qux_params), number=n_calls )
+    t_access    = timeit.timeit( lambda: free_access(qux, [], qux_params), number=n_calls )
+    print("per-call free_access with signature analysis: {:.2f} us, via cached adapter: {:.2f} us\n".format(t_analysis*1e6/n_calls, t_access*1e6/n_calls))
+
+    # the adapters do not outlive their functions (e.g. the ones replaced by a module reload):
+    import gc
+
+    def transient(alpha):
+        return alpha
+
+    free_access(transient, [1], {})
+    adapters_before = len(_call_adapters)
+    del transient
+    gc.collect()
+    print("call adapters before and after the function is gone: {} -> {}\n".format(adapters_before, len(_call_adapters)))
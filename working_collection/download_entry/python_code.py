@@ -7,6 +7,9 @@ Parameterizations of this entry can be recipes for downloading specific things.
 Create a new parameterized recipe:
     clip add_entry --entry_name=examplepage_recipe --data.parent_entry_name=download_entry --data.url='http://example.com/' --data.entry_name=examplepage_downloaded --data.file_name=example.html --data.remark='A specific parameterized downloader'
 
+A recipe may also carry the expected checksum and a segment size for parallel downloading of large files:
+    --data.sha256=<hex digest> --data.segment_size=16777216
+
 Activate the recipe, i.e. download the file into a new entry:
     clip byname --entry_name=examplepage_recipe , download
 
@@ -16,9 +19,15 @@ Clean up:
 """
 
 import os
+import threading
+
+_thread_local_state = threading.local()    # every downloading thread keeps its own keep-alive connection per host
+
+
+def download(url, entry_name, file_name, sha256=None, segment_size=None, max_workers=4, __kernel__=None):
+    """ Download the URL into a new entry. A recipe may also declare the expected sha256 of the file,
+        and a segment_size to fetch a large file in parallel HTTP Range segments (see fetch_segmented).
 
-def download(url, entry_name, file_name, __kernel__):
-    """
         Usage example:
             clip byname --entry_name=download_entry , download --url='https://example.com' --entry_name=examplepage_downloaded --file_name=example.html
 
@@ -34,19 +43,307 @@ def download(url, entry_name, file_name, __kernel__):
     new_entry = __kernel__.working_collection().call('add_entry', { 'entry_name' : entry_name, 'data': data})
     target_path = new_entry.get_path(file_name)
 
-    if download_to_path(url, target_path) == 0:
+    if download_to_path(url, target_path, sha256=sha256, segment_size=segment_size, max_workers=max_workers) == 0:
         return target_path
     else:
         return None
 
 
-def download_to_path(url, target_path):
-    """
+def download_to_path(url, target_path, engine='python', sha256=None, segment_size=None, max_workers=4):
+    """ Download the URL into the file using the built-in engine (or engine=wget, engine=curl), return 0 on success.
+        The built-in engine verifies sha256 if given, and downloads in parallel segments if segment_size is given.
+
         Usage example: (assuming the entry has been added to the collection) :
             clip byname --entry_name=download_entry , download_to_path --url='http://example.com' --target_path=exmpl.html
     """
     print('url = "{}", target_path = "{}"'.format(url, target_path))
-    return wget(url, target_path)
+    if engine=='wget':
+        return wget(url, target_path)
+    elif engine=='curl':
+        return curl(url, target_path)
+    elif segment_size:
+        status = fetch_segmented(url, target_path, segment_size, max_workers, sha256)
+    else:
+        status = fetch(url, target_path, sha256=sha256)
+
+    if status['error']:
+        print('Download failed: {}'.format(status['error']))
+        return 1
+    else:
+        return 0
+
+
+def pooled_connection(scheme, netloc, timeout, fresh=False):
+    "The current thread's keep-alive connection to the host, (re)opened on demand"
+
+    import http.client
+
+    connections = getattr(_thread_local_state, 'connections', None)
+    if connections==None:
+        connections = _thread_local_state.connections = {}
+
+    connection = connections.get( (scheme, netloc) )
+    if fresh and connection:
+        connection.close()
+        connection = None
+
+    if connection==None:
+        connection_class = http.client.HTTPSConnection if scheme=='https' else http.client.HTTPConnection
+        connection = connections[ (scheme, netloc) ] = connection_class(netloc, timeout=timeout)
+
+    return connection
+
+
+def pooled_request(url, method='GET', headers=None, timeout=30, max_redirects=5):
+    """ Send the request over the current thread's keep-alive connection to the host, following the redirects.
+        Returns the response (to be read completely before the connection can be reused) and the final URL.
+    """
+    import http.client
+    from urllib.parse import urlsplit, urljoin
+
+    for _ in range(max_redirects+1):
+        split_url   = urlsplit(url)
+        request_uri = (split_url.path or '/') + ('?'+split_url.query if split_url.query else '')
+
+        try:
+            for attempt in range(2):    # the server may have closed an idle keep-alive connection in the meantime
+                connection = pooled_connection(split_url.scheme, split_url.netloc, timeout, fresh=attempt>0)
+                try:
+                    connection.request(method, request_uri, headers=headers or {})
+                    response = connection.getresponse()
+                    break
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    if attempt>0:
+                        raise
+        except Exception:
+            pooled_connection(split_url.scheme, split_url.netloc, timeout, fresh=True)   # do not reuse a connection in an unknown state
+            raise
+
+        if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+            response.read()
+            url = urljoin(url, response.getheader('Location'))
+        else:
+            return response, url
+
+    raise http.client.HTTPException('too many redirects')
+
+
+def stream_to_file(response, target_file, chunk_size=64*1024, hasher=None):
+    "Copy the response body into an open file chunk by chunk, feeding the hasher along the way. Returns the number of bytes"
+
+    bytes_copied = 0
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        target_file.write(chunk)
+        if hasher:
+            hasher.update(chunk)
+        bytes_copied += len(chunk)
+
+    return bytes_copied
+
+
+def fetch(url, target_path, chunk_size=64*1024, timeout=30, max_redirects=5, sha256=None):
+    """ Download the URL into the file over a reused keep-alive connection, streaming the body to disk in chunks.
+        If sha256 is given, the body is verified while it streams.
+        The file only appears once it has been received (and verified) completely, and a failed attempt leaves nothing behind.
+        Returns the status of the download.
+
+        Usage example (not assuming the entry has been added to the collection) :
+            clip bypath --path=working_collection/download_entry , fetch --url='http://example.com' --target_path=exmpl.html
+    """
+    import hashlib
+
+    status      = { 'url': url, 'target_path': target_path, 'http_status': None, 'bytes': 0, 'error': None }
+    temp_path   = '{}.{}.part'.format(target_path, threading.get_ident())
+
+    try:
+        response, _ = pooled_request(url, timeout=timeout, max_redirects=max_redirects)
+        status['http_status'] = response.status
+
+        if response.status != 200:
+            response.read()     # the connection can only be reused once the response has been read
+            status['error'] = 'HTTP {} {}'.format(response.status, response.reason)
+            return status
+
+        hasher      = hashlib.sha256() if sha256 else None
+        with open(temp_path, 'wb') as target_file:
+            status['bytes'] = stream_to_file(response, target_file, chunk_size, hasher)
+        expected_bytes = response.getheader('Content-Length')
+        if expected_bytes and status['bytes']!=int(expected_bytes):     # the connection broke before the end of the body
+            raise IOError('got {} bytes of {}'.format(status['bytes'], expected_bytes))
+
+        if hasher and hasher.hexdigest()!=sha256.lower():
+            os.remove(temp_path)
+            status['error'] = 'sha256 mismatch: expected {}, got {}'.format(sha256, hasher.hexdigest())
+        else:
+            os.replace(temp_path, target_path)
+    except Exception as e:
+        status['error'] = '{}: {}'.format(type(e).__name__, e)
+        try:
+            os.remove(temp_path)    # a retry starts afresh (and possibly from another thread) anyway
+        except OSError:
+            pass
+
+    return status
+
+
+def fetch_segmented(url, target_path, segment_size=8*1024*1024, max_workers=4, sha256=None, chunk_size=64*1024, timeout=30):
+    """ Download a large file as HTTP Range segments fetched in parallel, each one written straight into its place
+        in a preallocated <target_path>.part file, which becomes the target once complete (and verified).
+        The progress of every segment is kept in <target_path>.parts.json , so that an interrupted attempt at the same version
+        of the remote file (as told by its ETag or Last-Modified, if the server sends either) is resumed rather than re-fetched.
+        sha256 is computed while the bytes arrive in order; only the ones that arrive ahead of it are read back (from the page cache).
+        Falls back to fetch() if the server does not support ranges or the file fits into one segment.
+
+        Usage example (not assuming the entry has been added to the collection) :
+            clip bypath --path=working_collection/download_entry , fetch_segmented --url='http://example.com/big.iso' --target_path=big.iso --segment_size=16777216
+    """
+    import json
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor
+
+    status = { 'url': url, 'target_path': target_path, 'http_status': None, 'bytes': 0, 'segments': 0, 'resumed_bytes': 0, 'error': None }
+
+    try:
+        response, url = pooled_request(url, method='HEAD', timeout=timeout)
+        response.read()
+        status['http_status']   = response.status
+        total_size              = int(response.getheader('Content-Length') or 0)
+
+        if response.status!=200 or response.getheader('Accept-Ranges')!='bytes' or total_size<=segment_size:
+            return dict(status, **fetch(url, target_path, chunk_size, timeout, sha256=sha256))
+
+        ## The progress of an earlier attempt can only be trusted if it was at the same version of the same remote file:
+        #
+        manifest_path   = target_path + '.parts.json'
+        temp_path       = target_path + '.part'
+        manifest        = { 'url': url, 'size': total_size, 'segment_size': segment_size,
+                            'version': response.getheader('ETag') or response.getheader('Last-Modified') }
+        segments        = [ (start, min(start+segment_size, total_size)) for start in range(0, total_size, segment_size) ]
+        segment_done    = [0] * len(segments)     # the bytes of each segment already in place (always a prefix of it)
+
+        try:
+            with open(manifest_path) as manifest_file:
+                old_manifest = json.load(manifest_file)
+            old_segment_done = old_manifest.pop('done')
+            if manifest['version']!=None and old_manifest==manifest and os.path.getsize(temp_path)==total_size:
+                segment_done = old_segment_done
+        except (OSError, ValueError, KeyError):
+            pass
+
+        def store_progress():
+            "Remember how far each segment has got (only if there will be a way to tell the remote file has not changed)"
+
+            if manifest['version']!=None:
+                with open(manifest_path+'.tmp', 'w') as manifest_file:
+                    json.dump(dict(manifest, done=segment_done), manifest_file)
+                os.replace(manifest_path+'.tmp', manifest_path)
+
+        target_fd = os.open(temp_path, os.O_RDWR | os.O_CREAT)
+        try:
+            if not any(segment_done):
+                os.ftruncate(target_fd, 0)
+            os.ftruncate(target_fd, total_size)
+            store_progress()
+
+            hasher          = hashlib.sha256() if sha256 else None
+            hashed_bytes    = 0             # the hasher has consumed the target up to this offset
+            progress_lock   = threading.Lock()
+
+            def hash_from_target(up_to):
+                "Feed the hasher with the bytes already in the target, up to the offset"
+                nonlocal hashed_bytes
+
+                while hashed_bytes < up_to:
+                    chunk = os.pread(target_fd, min(chunk_size, up_to-hashed_bytes), hashed_bytes)
+                    hasher.update(chunk)
+                    hashed_bytes += len(chunk)
+
+            def fetch_segment(segment_idx):
+                nonlocal hashed_bytes
+
+                start, end      = segments[segment_idx]
+                resumed_bytes   = segment_done[segment_idx]
+                offset          = start + resumed_bytes
+                if offset < end:
+                    response, _ = pooled_request(url, headers={ 'Range': 'bytes={}-{}'.format(offset, end-1) }, timeout=timeout)
+                    if response.status!=206:
+                        response.read()
+                        raise IOError('HTTP {} {} for the segment {}'.format(response.status, response.reason, segment_idx))
+                    while True:
+                        chunk = response.read(min(chunk_size, end-offset))
+                        if not chunk:
+                            break
+                        os.pwrite(target_fd, chunk, offset)
+                        with progress_lock:
+                            segment_done[segment_idx] = offset + len(chunk) - start
+                            if hasher and start <= hashed_bytes <= offset:     # this segment is the next one in line for hashing
+                                hash_from_target(offset)
+                                hasher.update(chunk)
+                                hashed_bytes += len(chunk)
+                        offset += len(chunk)
+                if offset != end:
+                    raise IOError('the segment {} is incomplete'.format(segment_idx))
+                return resumed_bytes
+
+            try:
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    segment_futures = [ pool.submit(fetch_segment, segment_idx) for segment_idx in range(len(segments)) ]
+                    for segment_idx, segment_future in enumerate(segment_futures):
+                        status['resumed_bytes'] += segment_future.result()
+                        with progress_lock:
+                            if hasher:      # the segments that completed before their turn
+                                hash_from_target( segments[segment_idx][1] )
+                            store_progress()
+                        status['bytes'] += segments[segment_idx][1] - segments[segment_idx][0]
+                        status['segments'] += 1
+            except BaseException:
+                store_progress()
+                raise
+        finally:
+            os.close(target_fd)
+
+        if hasher and hasher.hexdigest()!=sha256.lower():
+            os.remove(temp_path)
+            status['error'] = 'sha256 mismatch: expected {}, got {}'.format(sha256, hasher.hexdigest())
+        else:
+            os.replace(temp_path, target_path)
+
+        if os.path.exists(manifest_path):   # the segments are either complete or wrong, nothing to resume in both cases
+            os.remove(manifest_path)
+    except Exception as e:
+        status['error'] = '{}: {}'.format(type(e).__name__, e)
+        if 'manifest' in locals() and manifest['version']==None and os.path.exists(temp_path):    # cannot be resumed
+            os.remove(temp_path)
+
+    return status
+
+
+def download_many(urls, target_dir='.', target_paths=None, max_workers=8, chunk_size=64*1024, timeout=30):
+    """ Download the URLs concurrently with at most max_workers downloads in flight,
+        each worker reusing its keep-alive connections to the same hosts.
+        The files are named after the URLs unless target_paths are given (which they have to be if two URLs end in the same name).
+        Returns per-URL statuses in the original order.
+
+        Usage example (not assuming the entry has been added to the collection) :
+            clip bypath --path=working_collection/download_entry , download_many --urls,=http://example.com/,http://example.org/ --target_paths,=com.html,org.html
+    """
+    from urllib.parse import urlsplit
+    from concurrent.futures import ThreadPoolExecutor
+
+    if not target_paths:
+        target_paths = [ os.path.join(target_dir, os.path.basename(urlsplit(url).path) or 'index.html') for url in urls ]
+
+    url_by_target = {}
+    for url, target_path in zip(urls, target_paths):
+        other_url = url_by_target.setdefault( os.path.realpath(target_path), url )
+        if other_url!=url:
+            raise ValueError( "Both {} and {} would be downloaded into {}, please give explicit target_paths".format(other_url, url, target_path) )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list( pool.map( lambda url, target_path: fetch(url, target_path, chunk_size, timeout), urls, target_paths ) )
 
 
 def wget(url, target_path):
@@ -54,7 +351,9 @@ def wget(url, target_path):
         Usage example (not assuming the entry has been added to the collection) :
             clip bypath --path=working_collection/download_entry , wget --url='http://example.com' --target_path=exmpl.html
     """
-    return os.system('wget -O {} {}'.format(target_path, url))
+    from shlex import quote
+
+    return os.system('wget -O {} {}'.format(quote(target_path), quote(url)))
 
 
 def curl(url, target_path):
@@ -62,13 +361,123 @@ def curl(url, target_path):
         Usage example (not assuming the entry has been added to the collection) :
             clip bypath --path=working_collection/download_entry , curl --url='http://example.com' --target_path=exmpl.html
     """
-    return os.system('curl -o {} {}'.format(target_path, url))
+    from shlex import quote
+
+    return os.system('curl -o {} {}'.format(quote(target_path), quote(url)))
 
 
 if __name__ == '__main__':
 
     # When the entry's code is run as a script, perform local tests:
     #
+    import re
+    import json
+    import hashlib
+    import tempfile
+    from functools import partial
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+    with tempfile.TemporaryDirectory() as served_dir, tempfile.TemporaryDirectory() as target_dir:
+        for file_idx in range(20):
+            with open(os.path.join(served_dir, 'file{}.bin'.format(file_idx)), 'wb') as served_file:
+                served_file.write( os.urandom(100000 * (file_idx+1)) )
+
+        class RangeRequestHandler(SimpleHTTPRequestHandler):
+            "A stand-in for a real HTTP server: keep-alive and (single) Range requests"
+
+            protocol_version    = 'HTTP/1.1'
+            send_etags          = True
+
+            def log_message(self, *args):
+                pass
+
+            def send_head(self):
+                file_path = self.translate_path(self.path)
+                if not os.path.isfile(file_path):
+                    return super().send_head()
+
+                file_size   = os.path.getsize(file_path)
+                start, end  = 0, file_size-1
+                range_match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+                if range_match:
+                    start, end = int(range_match.group(1)), int(range_match.group(2) or end)
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, file_size))
+                else:
+                    self.send_response(200)
+                self.send_header('Accept-Ranges', 'bytes')
+                if self.send_etags:
+                    self.send_header('ETag', '"{}"'.format(os.stat(file_path).st_mtime_ns))
+                self.send_header('Content-Length', str(end-start+1))
+                self.end_headers()
+
+                served_file = open(file_path, 'rb')
+                served_file.seek(start)
+                self.bytes_left = end-start+1
+                return served_file
+
+            def copyfile(self, source, outputfile):
+                if self.path.endswith('/truncated.bin'):    # the connection breaks half way through the body
+                    outputfile.write( source.read(self.bytes_left//2) )
+                    self.close_connection = True
+                else:
+                    outputfile.write( source.read(self.bytes_left) )
+
+        server = ThreadingHTTPServer( ('127.0.0.1', 0), partial(RangeRequestHandler, directory=served_dir) )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        base_url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+        big_path        = os.path.join(served_dir, 'big.bin')
+        with open(big_path, 'wb') as big_file:
+            big_file.write( os.urandom(5000000) )
+        big_sha256      = hashlib.sha256( open(big_path, 'rb').read() ).hexdigest()
+        big_target_path = os.path.join(target_dir, 'big.bin')
+
+        def interrupted_attempt(target_path, version):
+            "Pretend an earlier attempt got interrupted half way through the first and the third segments"
+
+            with open(target_path+'.parts.json', 'w') as manifest_file:
+                json.dump( { 'url': base_url+'big.bin', 'size': 5000000, 'segment_size': 1000000, 'version': version, 'done': [500000, 0, 300000, 0, 0] }, manifest_file )
+            with open(big_path, 'rb') as big_file, open(target_path+'.part', 'wb') as temp_file:
+                temp_file.truncate(5000000)
+                temp_file.write( big_file.read(500000) )
+                big_file.seek(2000000)
+                temp_file.seek(2000000)
+                temp_file.write( big_file.read(300000) )
+
+        big_etag = '"{}"'.format(os.stat(big_path).st_mtime_ns)
+        interrupted_attempt(big_target_path, big_etag)
+        print( fetch_segmented(base_url+'big.bin', big_target_path, segment_size=1000000, sha256=big_sha256) )
+
+        RangeRequestHandler.send_etags = False      # with no way to tell the remote file is the same, nothing is resumed
+        interrupted_attempt(big_target_path+'.unversioned', None)
+        print( fetch_segmented(base_url+'big.bin', big_target_path+'.unversioned', segment_size=1000000, sha256=big_sha256) )
+        RangeRequestHandler.send_etags = True
+
+        print( "Leftovers: {}".format([ f for f in os.listdir(target_dir) if f.endswith('.part') or f.endswith('.json') ]) )
+        print( fetch_segmented(base_url+'big.bin', big_target_path+'.corrupt', segment_size=1000000, sha256='0'*64) )
+        print( fetch(base_url+'big.bin', big_target_path+'.single', sha256=big_sha256) )
+        os.remove(big_path)
+
+        with open(os.path.join(served_dir, 'truncated.bin'), 'wb') as truncated_file:
+            truncated_file.write( os.urandom(1000000) )
+        print( fetch(base_url+'truncated.bin', os.path.join(target_dir, 'truncated.bin')) )
+        os.remove( os.path.join(served_dir, 'truncated.bin') )
+        print( "Leftovers after a broken connection: {}".format([ f for f in os.listdir(target_dir) if f.startswith('truncated.bin') ]) )
+
+        try:
+            download_many( [ base_url+'file1.bin', base_url+'mirror/file1.bin' ], target_dir=target_dir )
+        except ValueError as e:
+            print( "Colliding targets refused: {}".format(e) )
+
+        statuses = download_many( [ base_url+'file{}.bin'.format(file_idx) for file_idx in range(20) ] + [ base_url+'missing.bin' ], target_dir=target_dir, max_workers=4 )
+        server.shutdown()
+
+        for status in statuses:
+            print("{url} -> HTTP {http_status}, {bytes} bytes, error={error}".format(**status))
+        print("All the downloaded files match: {}\n".format( all( open(os.path.join(served_dir, f), 'rb').read()==open(os.path.join(target_dir, f), 'rb').read() for f in os.listdir(served_dir) ) ))
+
     r1 = wget('https://www.1112.net/lastpage.html', target_path='lastpage.html')
     print("R_wget = {}\n".format(r1))
 